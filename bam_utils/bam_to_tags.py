@@ -0,0 +1,310 @@
+import numpy as np
+import os
+import sys
+import sqlite3
+import tempfile
+import itertools
+import argparse
+from contextlib import nullcontext
+from array import array
+from multiprocessing import Pool
+import pysam
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fast_tag_pileup'))
+from scidx_cache import read_chrom_sizes, write_cache, default_cache_dir
+
+_skip_flags = 0x4 | 0x100 | 0x800  # unmapped, secondary, supplementary
+
+def encode_tag(pos: int, reverse: bool, read1: bool):
+    """
+    Pack the 5' position, strand, and mate number of a read into one int (what the mate buffer stores)
+    """
+    return (pos << 2) | (reverse << 1) | read1
+
+class MateBuffer:
+    """
+    Unpaired mates keyed by read name, holding at most max_size in memory. When full, the oldest half is spilled to
+    an sqlite database in spill_dir and paired up in one join once the input is exhausted.
+
+    max_size: int
+        Maximum number of unpaired mates kept in memory
+    spill_dir: str
+        Directory for the spill database (defaults to the system temporary directory)
+    """
+
+    def __init__(self, max_size: int = 1 << 20, spill_dir: str = None):
+        self.max_size = max_size
+        self.spill_dir = spill_dir
+        self.spilled = 0
+        self.orphans = 0
+        self._mates = {}
+        self._db = None
+        self._db_fn = None
+
+    def add(self, name: str, tag: int):
+        """
+        Returns the tag of the buffered mate of name and drops it from the buffer, or buffers tag and returns None
+        """
+        mate = self._mates.pop(name, None)
+        if mate is not None:
+            return mate
+        self._mates[name] = tag
+        if len(self._mates) > self.max_size:
+            self._spill(len(self._mates) // 2)
+        return None
+
+    def _spill(self, n: int):
+        if self._db is None:
+            fd, self._db_fn = tempfile.mkstemp(suffix='.sqlite', dir=self.spill_dir)
+            os.close(fd)
+            self._db = sqlite3.connect(self._db_fn)
+            self._db.execute('PRAGMA journal_mode = OFF')
+            self._db.execute('PRAGMA synchronous = OFF')
+            self._db.execute('CREATE TABLE mates (name TEXT, tag INTEGER)')
+        # dicts iterate in insertion order, so these are the mates that have waited longest
+        oldest = list(itertools.islice(self._mates.items(), n))
+        self._db.executemany('INSERT INTO mates VALUES (?, ?)', oldest)
+        for name, _ in oldest:
+            del self._mates[name]
+        self.spilled += n
+
+    def drain(self):
+        """
+        Yields (tag, tag) pairs of the mates that met only after one was spilled, then empties the buffer and sets
+        orphans to the number of mates left without a pair
+        """
+        if self._db is None:
+            self.orphans = len(self._mates)
+            self._mates.clear()
+            return
+        self._spill(len(self._mates))
+        self._db.execute('CREATE INDEX mates_name ON mates (name)')
+        paired = 0
+        for a, b in self._db.execute('SELECT a.tag, b.tag FROM mates a JOIN mates b '
+                                     'ON a.name = b.name AND a.rowid < b.rowid'):
+            paired += 2
+            yield a, b
+        self.orphans = self.spilled - paired
+        self.close()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            os.remove(self._db_fn)
+            self._db = None
+            self.spilled = 0
+        self._mates.clear()
+
+class TagCounts:
+    """
+    Dense (size, 2) int32 array of forward and reverse tag counts that positions are added to in blocks, so that at
+    most 2 block_size positions are held besides the counts
+
+    size: int
+        Size of the contig
+    block_size: int
+        Number of positions per strand buffered before they are added to the counts
+    """
+
+    def __init__(self, size: int, block_size: int = 1 << 16):
+        self.counts = np.zeros((size, 2), dtype=np.int32)
+        self.block_size = block_size
+        self._blocks = (array('q'), array('q'))
+
+    def add(self, pos: int, reverse: bool):
+        strand = int(reverse)
+        block = self._blocks[strand]
+        block.append(pos)
+        if len(block) >= self.block_size:
+            self._flush(strand)
+
+    def _flush(self, strand: int):
+        block = self._blocks[strand]
+        if block:
+            pos, n = np.unique(np.frombuffer(block, dtype=np.int64), return_counts=True)
+            self.counts[pos, strand] += n.astype(np.int32)
+            del block[:]
+
+    def finish(self):
+        """
+        Add the buffered positions and return the counts
+        """
+        self._flush(0)
+        self._flush(1)
+        return self.counts
+
+def _add_tag(tag: int, read: str, counts: TagCounts):
+    if read == 'both' or (tag & 1) == (read == '1'):
+        counts.add(tag >> 2, bool(tag & 2))
+
+def count_contig(bam_fn: str, contig: str, size: int, read: str = '1', min_mapq: int = 0,
+                 skip_duplicates: bool = False, max_buffer: int = 1 << 20, spill_dir: str = None,
+                 block_size: int = 1 << 16):
+    """
+    bam_fn: str
+        Path to the indexed BAM file
+    contig: str
+        Contig to count
+    size: int
+        Size of the contig
+    read: str
+        Which 5' ends of a read pair to count: '1', '2', or 'both'. Single-end reads are always counted.
+    min_mapq: int
+        Minimum mapping quality of each counted read and its mate
+    skip_duplicates: bool
+        If True, ignore reads flagged as PCR or optical duplicates
+    max_buffer: int
+        Maximum number of unpaired mates kept in memory (see MateBuffer)
+    spill_dir: str
+        Directory for spilled mates
+    block_size: int
+        Number of tags per strand buffered before they are added to the counts (see TagCounts)
+
+    Returns a dense (size, 2) int32 array of forward and reverse 5' tag counts and a dict of read counts. Only pairs
+    with both mates mapped (as primary alignments) to this contig are counted. Besides the counts, memory is bounded
+    by max_buffer and block_size; only the spilled mates grow with the number of reads.
+    """
+    counts = TagCounts(size, block_size)
+    stats = {'pairs': 0, 'single': 0, 'orphans': 0, 'spilled': 0}
+    skip = _skip_flags | (0x400 if skip_duplicates else 0)
+    buffer = MateBuffer(max_buffer, spill_dir)
+    try:
+        with pysam.AlignmentFile(bam_fn, 'rb') as bam:
+            for record in bam.fetch(contig):
+                flag = record.flag
+                if flag & skip or record.mapping_quality < min_mapq:
+                    continue
+                is_reverse = bool(flag & 0x10)
+                pos = record.reference_end - 1 if is_reverse else record.reference_start
+                if pos >= size:
+                    continue
+                tag = encode_tag(pos, is_reverse, bool(flag & 0x40))
+                if not flag & 0x1:
+                    stats['single'] += 1
+                    counts.add(pos, is_reverse)
+                    continue
+                if flag & 0x8 or record.next_reference_id != record.reference_id:
+                    continue
+                mate = buffer.add(record.query_name, tag)
+                if mate is not None:
+                    stats['pairs'] += 1
+                    _add_tag(tag, read, counts)
+                    _add_tag(mate, read, counts)
+            stats['spilled'] = buffer.spilled
+            for a, b in buffer.drain():
+                stats['pairs'] += 1
+                _add_tag(a, read, counts)
+                _add_tag(b, read, counts)
+            stats['orphans'] = buffer.orphans
+    finally:
+        buffer.close()
+    return counts.finish(), stats
+
+def _count_task(task):
+    bam_fn, contig, size, kwargs = task
+    counts, stats = count_contig(bam_fn, contig, size, **kwargs)
+    # send only the nonzero positions back to the parent
+    pos = np.flatnonzero(counts.any(axis=1))
+    return contig, pos, counts[pos], stats
+
+def bam_to_tags(bam_fn: str, sizes: dict = None, processes: int = None, **kwargs):
+    """
+    bam_fn: str
+        Path to the BAM file (sorted; it is indexed first if it has no index)
+    sizes: dict
+        Dict mapping chromosome names to their sizes (defaults to the contigs in the BAM header). Contigs that are
+        not in sizes are skipped.
+    processes: int
+        Number of worker processes, each counting one contig at a time (defaults to the number of CPUs, 1 counts in
+        this process)
+    kwargs:
+        Passed to count_contig
+
+    Returns a dict mapping chromosome names to dense (size, 2) int32 arrays of forward and reverse tag counts (the
+    same as scidx_cache.parse_scidx) and a dict of read counts summed over contigs
+    """
+    with pysam.AlignmentFile(bam_fn, 'rb') as bam:
+        if not bam.has_index():
+            pysam.index(bam_fn)
+        lengths = dict(zip(bam.references, bam.lengths))
+    if sizes is None:
+        sizes = lengths
+    chrom_dict = {chrom: np.zeros((size, 2), dtype=np.int32) for chrom, size in sizes.items()}
+    # largest contigs first so that one long contig does not finish last
+    tasks = sorted(((bam_fn, chrom, size, kwargs) for chrom, size in sizes.items() if chrom in lengths),
+                   key=lambda task: -task[2])
+    totals = {}
+    with Pool(processes) if processes != 1 else nullcontext() as pool:
+        results = pool.imap_unordered(_count_task, tasks) if pool is not None else map(_count_task, tasks)
+        for chrom, pos, counts, stats in results:
+            chrom_dict[chrom][pos] = counts
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+    return chrom_dict, totals
+
+def build_bam_cache(bam_fn: str, sizes: dict = None, cache_dir: str = None, sparse: bool = None, **kwargs):
+    """
+    bam_fn: str
+        Path to the BAM file
+    sizes: dict
+        Dict mapping chromosome names to their sizes (defaults to the contigs in the BAM header)
+    cache_dir: str
+        Path to the cache directory (defaults to <bam_fn>.cache)
+    sparse: bool
+        Cache format, see scidx_cache.write_cache
+    kwargs:
+        Passed to bam_to_tags
+
+    Writes the tag counts of the BAM file as a scidx cache that scidx_cache.load_scidx (and bulk_pileup --cache)
+    reads directly, without an intermediate scidx file. Returns the read counts.
+    """
+    st = os.stat(bam_fn)
+    chrom_dict, stats = bam_to_tags(bam_fn, sizes, **kwargs)
+    write_cache(chrom_dict, cache_dir or default_cache_dir(bam_fn),
+                source={'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, sparse=sparse)
+    return stats
+
+def write_scidx(chrom_dict: dict, out: str):
+    """
+    Write tag counts as a scidx file (nonzero positions only)
+    """
+    with open(out, 'w') as f:
+        f.write('# bam_to_tags\n')
+        f.write('chrom\tindex\tforward\treverse\tvalue\n')
+        for chrom, arr in chrom_dict.items():
+            pos = np.flatnonzero(arr.any(axis=1))
+            for p, (fw, rv) in zip((pos + 1).tolist(), arr[pos].tolist()):
+                f.write('{}\t{}\t{}\t{}\t{}\n'.format(chrom, p, fw, rv, fw + rv))
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('bam_fns', nargs='+', help='sorted BAM files')
+    parser.add_argument('--chrom_sizes', '-cs', default=None, help='chrom.sizes file (defaults to the BAM header)')
+    parser.add_argument('--read', '-r', choices=['1', '2', 'both'], default='1',
+                        help='which 5\' ends of a read pair to count')
+    parser.add_argument('--min_mapq', '-q', type=int, default=0, help='minimum mapping quality')
+    parser.add_argument('--skip_duplicates', action='store_true', help='ignore reads flagged as duplicates')
+    parser.add_argument('--max_buffer', type=int, default=1 << 20,
+                        help='maximum number of unpaired mates kept in memory per process before spilling to disk')
+    parser.add_argument('--spill_dir', default=None, help='directory for spilled mates')
+    parser.add_argument('--block_size', type=int, default=1 << 16,
+                        help='number of tags per strand buffered before they are added to the counts')
+    parser.add_argument('--processes', '-p', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--scidx', action='store_true', help='write <bam_fn>.scidx instead of a binary cache')
+    parser.add_argument('--sparse', action='store_true', default=None, help='force the sparse cache format')
+    parser.add_argument('--dense', action='store_false', dest='sparse', help='force the dense cache format')
+    args = parser.parse_args(argv)
+
+    sizes = read_chrom_sizes(args.chrom_sizes) if args.chrom_sizes is not None else None
+    kwargs = dict(processes=args.processes, read=args.read, min_mapq=args.min_mapq,
+                  skip_duplicates=args.skip_duplicates, max_buffer=args.max_buffer, spill_dir=args.spill_dir,
+                  block_size=args.block_size)
+    for bam_fn in args.bam_fns:
+        if args.scidx:
+            chrom_dict, stats = bam_to_tags(bam_fn, sizes, **kwargs)
+            write_scidx(chrom_dict, '{}.scidx'.format(os.path.splitext(bam_fn)[0]))
+        else:
+            stats = build_bam_cache(bam_fn, sizes, sparse=args.sparse, **kwargs)
+        print(bam_fn, ' '.join('{}={}'.format(key, value) for key, value in stats.items()))
+
+if __name__ == '__main__':
+    main()
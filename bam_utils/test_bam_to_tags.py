@@ -0,0 +1,97 @@
+import os
+import sys
+import numpy as np
+import pytest
+pysam = pytest.importorskip('pysam')
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bam_to_tags import bam_to_tags, count_contig
+
+sizes = {'chrA': 5000, 'chrB': 3000}
+
+def _segment(header, name, flag, contig, pos, mapq, mate_contig, mate_pos):
+    record = pysam.AlignedSegment(header)
+    record.query_name = name
+    record.flag = flag
+    record.reference_name = contig
+    record.reference_start = pos
+    record.mapping_quality = mapq
+    record.cigarstring = '20M'
+    record.query_sequence = 'A' * 20
+    if mate_contig is not None:
+        record.next_reference_name = mate_contig
+        record.next_reference_start = mate_pos
+    return record
+
+@pytest.fixture(scope='module')
+def bam_fn(tmp_path_factory):
+    """
+    Synthetic BAM of 3000 read pairs (some with a low-quality, duplicate, or other-contig mate) and 300 single-end
+    reads, with the records of every pair far enough apart that small mate buffers spill
+    """
+    rng = np.random.default_rng(0)
+    header = pysam.AlignmentHeader.from_dict({'HD': {'SO': 'coordinate'},
+                                              'SQ': [{'SN': chrom, 'LN': size} for chrom, size in sizes.items()]})
+    records = []
+    for i in range(3000):
+        contig = 'chrA' if i % 3 else 'chrB'
+        pos1, pos2 = sorted(rng.integers(0, sizes[contig] - 20, 2).tolist())
+        mate_contig = 'chrA' if i % 50 == 0 else contig
+        reverse = bool(rng.integers(2))
+        flag1 = 0x1 | 0x40 | (0x10 if reverse else 0x20) | (0x400 if i % 40 == 0 else 0)
+        flag2 = 0x1 | 0x80 | (0x20 if reverse else 0x10)
+        mapq2 = 5 if i % 17 == 0 else 60
+        records.append(_segment(header, 'p{}'.format(i), flag1, contig, pos1, 60, mate_contig, pos2))
+        records.append(_segment(header, 'p{}'.format(i), flag2, mate_contig, pos2, mapq2, contig, pos1))
+    for i in range(300):
+        contig = 'chrA' if i % 2 else 'chrB'
+        records.append(_segment(header, 's{}'.format(i), 0x10 if i % 3 else 0, contig,
+                                int(rng.integers(0, sizes[contig] - 20)), 60, None, None))
+    records.sort(key=lambda record: (record.reference_id, record.reference_start))
+    fn = str(tmp_path_factory.mktemp('bam') / 'test.bam')
+    with pysam.AlignmentFile(fn, 'wb', header=header) as bam:
+        for record in records:
+            bam.write(record)
+    pysam.index(fn)
+    return fn
+
+def naive_counts(bam_fn, read='1', min_mapq=0, skip_duplicates=False):
+    counts = {chrom: np.zeros((size, 2), dtype=np.int32) for chrom, size in sizes.items()}
+    mates = {}
+    with pysam.AlignmentFile(bam_fn, 'rb') as bam:
+        for record in bam:
+            if record.flag & 0x904 or record.mapping_quality < min_mapq:
+                continue
+            if skip_duplicates and record.is_duplicate:
+                continue
+            pos = record.reference_end - 1 if record.is_reverse else record.reference_start
+            if not record.is_paired:
+                counts[record.reference_name][pos, int(record.is_reverse)] += 1
+            elif not record.mate_is_unmapped and record.next_reference_id == record.reference_id:
+                mates.setdefault((record.reference_name, record.query_name), []).append(record)
+    for (chrom, _), pair in mates.items():
+        if len(pair) != 2:
+            continue
+        for record in pair:
+            if read == 'both' or record.is_read1 == (read == '1'):
+                pos = record.reference_end - 1 if record.is_reverse else record.reference_start
+                counts[chrom][pos, int(record.is_reverse)] += 1
+    return counts
+
+@pytest.mark.parametrize('read', ['1', '2', 'both'])
+@pytest.mark.parametrize('max_buffer', [7, 10, 1 << 20])
+def test_count_contig_matches_naive(bam_fn, read, max_buffer):
+    expected = naive_counts(bam_fn, read=read, min_mapq=10, skip_duplicates=True)
+    for chrom, size in sizes.items():
+        counts, stats = count_contig(bam_fn, chrom, size, read=read, min_mapq=10, skip_duplicates=True,
+                                     max_buffer=max_buffer, block_size=5)
+        assert np.array_equal(counts, expected[chrom])
+        assert (stats['spilled'] > 0) == (max_buffer < 1 << 20)
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_bam_to_tags_matches_naive(bam_fn, processes):
+    expected = naive_counts(bam_fn, read='both')
+    chrom_dict, stats = bam_to_tags(bam_fn, processes=processes, read='both', max_buffer=10)
+    assert set(chrom_dict) == set(sizes)
+    for chrom in sizes:
+        assert np.array_equal(chrom_dict[chrom], expected[chrom])
+    assert stats['single'] == 300
@@ -0,0 +1,254 @@
+import numpy as np
+import pandas as pd
+import os
+import json
+import argparse
+
+_format_version = 1
+binary_ext = '.cdtb'
+
+def is_binary_cdt(path):
+    """
+    Check if a path is a binary CDT (a directory with meta.json, matrix.bin, and index.tsv)
+    """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json'))
+
+def cdt_size(path):
+    """
+    Size in bytes of a text CDT, or of the matrix.bin and index.tsv of a binary CDT
+    """
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, fn)) for fn in ('matrix.bin', 'index.tsv')
+                   if os.path.exists(os.path.join(path, fn)))
+    return os.path.getsize(path)
+
+def read_cdt_header(path):
+    """
+    Column labels and the names of the two index columns of a text or binary CDT, without reading its rows
+    """
+    if is_binary_cdt(path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return meta['columns'], meta['index_names']
+    with open(path) as f:
+        labels = f.readline().rstrip('\n').split('\t')
+    return labels[2:], labels[:2]
+
+def load_cdt_matrix(path, mode='r'):
+    """
+    Memory-map a binary CDT
+    Args:
+        path: Path to the binary CDT
+        mode: numpy.memmap mode ('r' for read-only, 'r+' to modify in place, 'c' for copy-on-write)
+
+    Returns:
+        Row MultiIndex, column labels, and the (n_rows, n_columns) memory-mapped matrix
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    shape = tuple(meta['shape'])
+    if shape[0] * shape[1] == 0:
+        matrix = np.empty(shape, dtype=meta['dtype'])
+    else:
+        matrix = np.memmap(os.path.join(path, 'matrix.bin'), dtype=meta['dtype'], mode=mode, shape=shape)
+    index = pd.read_csv(os.path.join(path, 'index.tsv'), sep='\t')
+    return pd.MultiIndex.from_frame(index), pd.Index(meta['columns']), matrix
+
+def read_cdt(path, mmap=True):
+    """
+    Read a CDT from either the tab-separated text format or the binary format
+    Args:
+        path: Path to the CDT
+        mmap: If True, binary CDTs are wrapped without copying the memory-mapped matrix
+
+    Returns:
+        DataFrame indexed by the first two columns of the CDT
+    """
+    if is_binary_cdt(path):
+        index, columns, matrix = load_cdt_matrix(path)
+        return pd.DataFrame(matrix if mmap else np.array(matrix), index=index, columns=columns, copy=False)
+    return pd.read_csv(path, sep='\t', index_col=(0, 1))
+
+def iter_cdt_chunks(path, chunksize=10000):
+    """
+    Iterate over row chunks of a text or binary CDT
+    Args:
+        path: Path to the CDT
+        chunksize: Number of rows per chunk
+
+    Returns:
+        Generator of DataFrames indexed by the first two columns of the CDT (binary chunks are memory-mapped views)
+    """
+    if is_binary_cdt(path):
+        index, columns, matrix = load_cdt_matrix(path)
+        for i in range(0, len(matrix), chunksize):
+            yield pd.DataFrame(matrix[i:i + chunksize], index=index[i:i + chunksize], columns=columns, copy=False)
+    else:
+        yield from pd.read_csv(path, sep='\t', index_col=(0, 1), chunksize=chunksize)
+
+def write_cdt(cdt, path):
+    """
+    Write a CDT in the binary format if path ends with .cdtb, otherwise as tab-separated text
+    """
+    if path.endswith(binary_ext):
+        with CDTWriter(path, cdt.columns, cdt.index.names) as writer:
+            writer.write(cdt)
+    else:
+        cdt.to_csv(path, sep='\t')
+
+class CDTWriter:
+    """
+    Incrementally write row chunks of a CDT to the binary format. The matrix dtype is taken from the first chunk and
+    upgraded to float64 if a later chunk is not integral.
+    """
+
+    def __init__(self, path, columns, index_names):
+        self.path = path
+        self.columns = [str(column) for column in columns]
+        self.index_names = [str(name) for name in index_names]
+        self.dtype = None
+        self.n_rows = 0
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            os.remove(os.path.join(path, 'meta.json'))
+        self._matrix = open(os.path.join(path, 'matrix.bin'), 'wb')
+        self._index = open(os.path.join(path, 'index.tsv'), 'w')
+        self._index.write('\t'.join(self.index_names) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.close(finalize=exc_type is None)
+
+    def _upgrade(self, block_size=1 << 20):
+        # convert what was written so far block by block into a new file, so memory use does not grow with the rows
+        self._matrix.close()
+        matrix_fn = os.path.join(self.path, 'matrix.bin')
+        tmp_fn = '{}.tmp'.format(matrix_fn)
+        with open(matrix_fn, 'rb') as f_in, open(tmp_fn, 'wb') as f_out:
+            while True:
+                block = np.fromfile(f_in, dtype=self.dtype, count=block_size)
+                if len(block) == 0:
+                    break
+                f_out.write(block.astype(np.float64).tobytes())
+        os.replace(tmp_fn, matrix_fn)
+        self.dtype = np.dtype(np.float64)
+        self._matrix = open(matrix_fn, 'ab')
+
+    def write(self, chunk):
+        """
+        Append a DataFrame chunk with the same columns, indexed by the two CDT label columns
+        """
+        values = chunk.to_numpy()
+        if values.dtype.kind not in 'iuf':
+            values = values.astype(np.float64)
+        if self.dtype is None:
+            self.dtype = np.dtype(np.int64 if values.dtype.kind in 'iu' else np.float64)
+        elif self.dtype.kind in 'iu' and values.dtype.kind == 'f':
+            self._upgrade()
+        self._matrix.write(np.ascontiguousarray(values, dtype=self.dtype).tobytes())
+        chunk.index.to_frame(index=False).to_csv(self._index, sep='\t', header=False, index=False)
+        self.n_rows += len(chunk)
+
+    def close(self, finalize=True):
+        self._matrix.close()
+        self._index.close()
+        if finalize:
+            meta = {'version': _format_version, 'dtype': (self.dtype or np.dtype(np.float64)).str,
+                    'shape': [self.n_rows, len(self.columns)], 'columns': self.columns,
+                    'index_names': self.index_names}
+            with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+
+class TextCDTWriter:
+    """
+    Incrementally write row chunks of a CDT as tab-separated text. If columns and index_names are given, a CDT with
+    no rows is written as just the header.
+    """
+
+    def __init__(self, path, columns=None, index_names=None):
+        self._f = open(path, 'w')
+        self._header = True
+        self.columns = columns
+        self.index_names = index_names
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, chunk):
+        chunk.to_csv(self._f, sep='\t', header=self._header)
+        self._header = False
+
+    def close(self):
+        if self._header and self.columns is not None:
+            index = pd.MultiIndex.from_arrays([[], []], names=self.index_names)
+            self.write(pd.DataFrame(columns=self.columns, index=index))
+        self._f.close()
+
+def open_cdt_writer(path, columns, index_names):
+    """
+    Open an incremental CDT writer, binary if path ends with .cdtb, otherwise tab-separated text
+    """
+    if path.endswith(binary_ext):
+        return CDTWriter(path, columns, index_names)
+    return TextCDTWriter(path, columns, index_names)
+
+def convert_cdt(in_path, out_path, chunksize=10000):
+    """
+    Convert a CDT between the text and binary formats (the output format is chosen by the .cdtb extension)
+    Args:
+        in_path: Path to the input CDT
+        out_path: Path to the output CDT
+        chunksize: Number of rows converted at a time
+    """
+    if is_binary_cdt(in_path):
+        index, columns, matrix = load_cdt_matrix(in_path)
+        header = True
+        for i in range(0, max(len(matrix), 1), chunksize):
+            chunk = pd.DataFrame(matrix[i:i + chunksize], index=index[i:i + chunksize], columns=columns)
+            chunk.to_csv(out_path, sep='\t', mode='w' if header else 'a', header=header)
+            header = False
+        return
+
+    columns, index_names = read_cdt_header(in_path)
+    if not out_path.endswith(binary_ext):
+        raise ValueError('Output of a text CDT conversion must end with {}'.format(binary_ext))
+    with CDTWriter(out_path, columns, index_names) as writer:
+        for chunk in pd.read_csv(in_path, sep='\t', index_col=(0, 1), chunksize=chunksize):
+            writer.write(chunk)
+
+def pileup_to_cdt(h5_fn, group, strand, out_path):
+    """
+    Write the per-site tag matrix of a pileup reference group as a CDT
+    Args:
+        h5_fn: Path to the pileup h5 file
+        group: Path to the reference group (target-cond/sample_id/ref)
+        strand: 'forward' or 'reverse'
+        out_path: Path to the output CDT (binary if it ends with .cdtb)
+    """
+    import h5py
+    with h5py.File(h5_fn, 'r') as h5:
+        ref_group = h5[group]
+        sites = ref_group['sites'].asstr()[:]
+        matrix = ref_group['{}_matrix'.format(strand)][:]
+    index = pd.MultiIndex.from_arrays([sites, sites], names=['YORF', 'NAME'])
+    write_cdt(pd.DataFrame(matrix, index=index, columns=[str(i) for i in range(matrix.shape[1])]), out_path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('in_path', help='input CDT (text, binary, or pileup h5 file with --group)')
+    parser.add_argument('out_path', help='output CDT (binary if it ends with {})'.format(binary_ext))
+    parser.add_argument('--chunksize', '-c', type=int, default=10000, help='number of rows converted at a time')
+    parser.add_argument('--group', '-g', default=None, help='pileup reference group to export from an h5 file')
+    parser.add_argument('--strand', '-s', default='forward', choices=['forward', 'reverse'],
+                        help='strand of the pileup matrix to export')
+    args = parser.parse_args()
+
+    if args.group is not None:
+        pileup_to_cdt(args.in_path, args.group, args.strand, args.out_path)
+    else:
+        convert_cdt(args.in_path, args.out_path, chunksize=args.chunksize)
@@ -1,16 +1,74 @@
+import numpy as np
 import pandas as pd
 import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cdt_utils'))
+from cdt_format import iter_cdt_chunks, open_cdt_writer, cdt_size, read_cdt_header
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_utils'))
+import stage_profiler
 
 def normalize_cdt(cdt_in, scaling_cdt):
     return (cdt_in.T / scaling_cdt.loc[cdt_in.index].sum(axis=1)).T
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('input_cdt')
+def scaling_sums(scaling_cdt, chunksize=10000):
+    """
+    Row sums of a scaling CDT (path or DataFrame), read in row chunks
+    """
+    if isinstance(scaling_cdt, pd.DataFrame):
+        return scaling_cdt.sum(axis=1)
+    return pd.concat([chunk.sum(axis=1) for chunk in iter_cdt_chunks(scaling_cdt, chunksize=chunksize)])
+
+def normalize_cdts(input_cdts, scaling_cdt, outs, chunksize=10000):
+    """
+    Normalize many CDTs against one scaling CDT, streaming each input in row chunks
+    Args:
+        input_cdts: Paths to the input CDTs (text or binary)
+        scaling_cdt: Path to the scaling CDT or a DataFrame
+        outs: Output paths, one per input (binary if they end with .cdtb)
+        chunksize: Number of rows held in memory at a time
+    """
+    with stage_profiler.stage('scaling_sums') as stage:
+        sums = scaling_sums(scaling_cdt, chunksize=chunksize)
+        stage.add(rows=len(sums), bytes_read=0 if isinstance(scaling_cdt, pd.DataFrame) else cdt_size(scaling_cdt))
+    sum_values = sums.to_numpy(dtype=np.float64)
+    for input_cdt, out in zip(input_cdts, outs):
+        with stage_profiler.stage('normalize', bytes_read=cdt_size(input_cdt)) as stage:
+            # opened from the header so that an input without rows still gets a (header-only) output
+            with open_cdt_writer(out, *read_cdt_header(input_cdt)) as writer:
+                for chunk in iter_cdt_chunks(input_cdt, chunksize=chunksize):
+                    rows = sums.index.get_indexer(chunk.index)
+                    if np.any(rows < 0):
+                        raise KeyError('{} rows of {} are missing from the scaling CDT'.format(np.sum(rows < 0),
+                                                                                              input_cdt))
+                    normalized = pd.DataFrame(chunk.to_numpy() / sum_values[rows, None], index=chunk.index,
+                                              columns=chunk.columns)
+                    writer.write(normalized)
+                    stage.add(rows=len(chunk))
+            stage.add(bytes_written=cdt_size(out))
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('input_cdt', nargs='+')
     parser.add_argument('scaling_cdt')
     parser.add_argument('--out', '-o', default='histone_normalized.cdt', dest='out')
-    args = parser.parse_args()
+    parser.add_argument('--out-dir', '-d', default=None, dest='out_dir',
+                        help='write <input>_histone_normalized.cdt files here when normalizing several inputs')
+    parser.add_argument('--chunksize', '-c', type=int, default=10000, dest='chunksize')
+    stage_profiler.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
 
-    cdt_in = pd.read_csv(args.input_cdt, sep='\t', index_col=(0, 1))
-    scaling_cdt = pd.read_csv(args.scaling_cdt, sep='\t', index_col=(0, 1))
-    normalize_cdt(cdt_in, scaling_cdt).to_csv(args.out, sep='\t')
+    if len(args.input_cdt) == 1 and args.out_dir is None:
+        outs = [args.out]
+    else:
+        outs = []
+        for input_cdt in args.input_cdt:
+            root, ext = os.path.splitext(os.path.basename(os.path.normpath(input_cdt)))
+            outs.append(os.path.join(args.out_dir or '.', '{}_histone_normalized{}'.format(root, ext or '.cdt')))
+    if args.out_dir is not None:
+        os.makedirs(args.out_dir, exist_ok=True)
+    with stage_profiler.profiler_from_args('histone_norm', args):
+        normalize_cdts(args.input_cdt, args.scaling_cdt, outs, chunksize=args.chunksize)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import numpy as np
+import pandas as pd
+import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cdt_utils'))
+from cdt_format import is_binary_cdt, load_cdt_matrix, cdt_size
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_utils'))
+import stage_profiler
+
+def _data_columns(cdt_fn):
+    with open(cdt_fn) as f:
+        return len(f.readline().rstrip('\n').split('\t')) - 2
+
+def _sum_columns(values, cols):
+    if values.dtype.kind in 'iu':
+        return values[:, cols].sum(axis=1)
+    return np.nansum(values[:, cols], axis=1)
+
+def window_sums(cdt, windows, chunksize=10000):
+    """
+    Sum the columns of a CDT within each window without reading the columns outside the windows
+    Args:
+        cdt: Path to a text or binary CDT, or a DataFrame indexed by its first two columns
+        windows: List of slices over the data columns (excluding the two index columns)
+        chunksize: Number of rows read at a time from a CDT file
+
+    Returns:
+        Row index and a (n_rows, n_windows) array of window sums (integer if all the summed values are integers)
+    """
+    with stage_profiler.stage('window_sums') as stage:
+        index, sums = _window_sums(cdt, windows, chunksize=chunksize)
+        stage.add(rows=len(index), bytes_read=0 if isinstance(cdt, pd.DataFrame) else cdt_size(cdt))
+    return index, sums
+
+def _window_sums(cdt, windows, chunksize=10000):
+    if isinstance(cdt, pd.DataFrame):
+        values = cdt.to_numpy()
+        cols = [np.arange(values.shape[1])[window] for window in windows]
+        return cdt.index, np.column_stack([_sum_columns(values, col) for col in cols])
+
+    if is_binary_cdt(cdt):
+        index, _, matrix = load_cdt_matrix(cdt)
+        return index, np.column_stack([_sum_columns(matrix, window) for window in windows])
+
+    cols = [np.arange(_data_columns(cdt))[window] for window in windows]
+    usecols = np.unique(np.concatenate(cols))
+    positions = [np.searchsorted(usecols, col) for col in cols]
+    indices, chunks = [], []
+    is_int = True
+    for chunk in pd.read_csv(cdt, sep='\t', index_col=(0, 1), usecols=[0, 1, *(usecols + 2)], chunksize=chunksize):
+        values = chunk.to_numpy()
+        is_int &= values.dtype.kind in 'iu'
+        chunks.append(np.column_stack([_sum_columns(values, pos) for pos in positions]))
+        indices.append(chunk.index)
+    index = indices[0].append(indices[1:]) if len(indices) > 1 else indices[0]
+    sums = np.concatenate(chunks)
+    return index, sums.astype(np.int64) if is_int else sums
+
+def sort_metrics(sense_cdts, anti_cdts, proximal_idx=slice(400, 551), distal_idx=slice(449, 600),
+                 metrics=('sum',), threshold=5, chunksize=10000):
+    """
+    Compute sort orders from proximal sense and distal antisense tag sums over pairs of replicate CDTs in one pass
+    Args:
+        sense_cdts: List of sense CDT paths or DataFrames
+        anti_cdts: List of antisense CDT paths or DataFrames, paired with sense_cdts
+        proximal_idx: Slice of the sense CDT columns to sum
+        distal_idx: Slice of the antisense CDT columns to sum
+        metrics: Sort metrics to compute ('sum', 'ratio', 'proximal', 'distal', 'difference', 'log2ratio')
+        threshold: Rows with proximal or distal sums at or below this are given a ratio of 0
+        chunksize: Number of rows read at a time from CDT files
+
+    Returns:
+        Dict mapping each metric to a Series sorted in descending order
+    """
+    idx = None
+    proximal = distal = 0
+    for sense_cdt, anti_cdt in zip(sense_cdts, anti_cdts):
+        sense_index, sense_sums = window_sums(sense_cdt, [proximal_idx], chunksize=chunksize)
+        anti_index, anti_sums = window_sums(anti_cdt, [distal_idx], chunksize=chunksize)
+        if idx is None:
+            idx = sense_index
+        sense_ser = pd.Series(sense_sums[:, 0], index=sense_index)
+        anti_ser = pd.Series(anti_sums[:, 0], index=anti_index)
+        proximal = proximal + (sense_ser.to_numpy() if sense_index.equals(idx) else sense_ser.reindex(idx).to_numpy())
+        distal = distal + (anti_ser.to_numpy() if anti_index.equals(idx) else anti_ser.reindex(idx).to_numpy())
+
+    sorts = {}
+    with stage_profiler.stage('sort', rows=len(idx) * len(metrics)):
+        for metric in metrics:
+            if metric == 'sum':
+                values = proximal + distal
+            elif metric == 'ratio':
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = proximal / distal
+                values[(proximal <= threshold) | (distal <= threshold)] = 0
+            elif metric == 'proximal':
+                values = proximal
+            elif metric == 'distal':
+                values = distal
+            elif metric == 'difference':
+                values = proximal - distal
+            elif metric == 'log2ratio':
+                values = np.log2((proximal + 1) / (distal + 1))
+            else:
+                raise ValueError('Unknown sort metric: {}'.format(metric))
+            sorts[metric] = pd.Series(values, index=idx).sort_values(ascending=False)
+    return sorts
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('--sense-cdt', '-s', nargs='+', dest='sense_cdt')
+    parser.add_argument('--anti-cdt', '-a', nargs='+', dest='anti_cdt')
+    parser.add_argument('--proximal-idx', '-p', type=int, nargs=2, dest='proximal_idx', default=(400, 551))
+    parser.add_argument('--distal-idx', '-d', type=int, nargs=2, dest='distal_idx', default=(449, 600))
+    parser.add_argument('--metric', '-m', nargs='+', dest='metric', default=['sum', 'ratio'],
+                        choices=['sum', 'ratio', 'proximal', 'distal', 'difference', 'log2ratio'])
+    parser.add_argument('--threshold', '-t', type=float, dest='threshold', default=5)
+    parser.add_argument('--chunksize', '-c', type=int, dest='chunksize', default=10000)
+    parser.add_argument('--out-prefix', '-o', default='proximal_distal_histone', dest='out_prefix')
+    stage_profiler.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with stage_profiler.profiler_from_args('cdt_sort', args):
+        sorts = sort_metrics(args.sense_cdt, args.anti_cdt, slice(*args.proximal_idx), slice(*args.distal_idx),
+                             metrics=args.metric, threshold=args.threshold, chunksize=args.chunksize)
+        with stage_profiler.stage('write', rows=sum(len(sort_ser) for sort_ser in sorts.values())):
+            for metric, sort_ser in sorts.items():
+                sort_ser.to_csv('{}_{}_sort.tsv'.format(args.out_prefix, metric), sep='\t', header=None)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,12 @@
-import pandas as pd
 import argparse
+import os
+import sys
+from cdt_sort import sort_metrics
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_utils'))
+import stage_profiler
 
 def get_sort(sense_cdts, anti_cdts, proximal_idx=slice(400, 551), distal_idx=slice(449, 600)):
-    idx = sense_cdts[0].index
-    sort_ser = pd.Series(dict.fromkeys(idx, 0))
-    for sense_cdt, anti_cdt in zip(sense_cdts, anti_cdts):
-        sort_ser += sense_cdt.iloc[:, proximal_idx].sum(axis='columns') + anti_cdt.iloc[:, distal_idx].sum(axis='columns')
-    return sort_ser.sort_values(ascending=False)
+    return sort_metrics(sense_cdts, anti_cdts, proximal_idx, distal_idx, metrics=('sum',))['sum']
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -15,10 +15,12 @@ if __name__ == '__main__':
     parser.add_argument('--proximal-idx', '-p', type=int, nargs=2, dest='proximal_idx', default=(400, 551))
     parser.add_argument('--distal-idx', '-d', type=int, nargs=2, dest='distal_idx', default=(449, 600))
     parser.add_argument('--out', '-o', default='proximal_distal_histone_sum_sort.tsv', dest='out')
+    stage_profiler.add_profile_arguments(parser)
     args = parser.parse_args()
 
-    sense_cdts = [pd.read_csv(sense_cdt, sep='\t', index_col=(0, 1)) for sense_cdt in args.sense_cdt]
-    anti_cdts = [pd.read_csv(anti_cdt, sep='\t', index_col=(0, 1)) for anti_cdt in args.anti_cdt]
     proximal_idx = slice(*args.proximal_idx)
     distal_idx = slice(*args.distal_idx)
-    get_sort(sense_cdts, anti_cdts, proximal_idx, distal_idx).to_csv(args.out, sep='\t', header=None)
+    with stage_profiler.profiler_from_args('proximal_distal_histone_sum', args):
+        sort_ser = get_sort(args.sense_cdt, args.anti_cdt, proximal_idx, distal_idx)
+        with stage_profiler.stage('write', rows=len(sort_ser)):
+            sort_ser.to_csv(args.out, sep='\t', header=None)
@@ -0,0 +1,209 @@
+import numpy as np
+import os
+import sys
+import re
+import h5py
+from filelock import SoftFileLock
+from multiprocessing import Pool
+import argparse
+from scidx_cache import read_chrom_sizes, parse_scidx, load_scidx
+from pileup_store import consolidate as consolidate_h5
+from bulk_pileup import (read_bed, in_bounds, pileup_ref, parse_sample_labels, parse_ref, init_sample_group,
+                         write_ref_group, file_signature, is_current, read_sample_table)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_utils'))
+import stage_profiler
+
+_worker_state = {}
+
+def _init_worker(sizes, refs, matrix, cache):
+    _worker_state.update(sizes=sizes, refs=refs, matrix=matrix, cache=cache)
+
+def _pileup_sample(task):
+    scidx_fn, todo = task
+    sizes = _worker_state['sizes']
+    if _worker_state['cache']:
+        chrom_dict = load_scidx(scidx_fn, sizes)
+    else:
+        chrom_dict = parse_scidx(scidx_fn, sizes)
+    results = []
+    for i in todo:
+        ref_name, length, bed, sites = _worker_state['refs'][i]
+        results.append((i, *pileup_ref(chrom_dict, sizes, bed, length, matrix=_worker_state['matrix'], sites=sites)))
+    return scidx_fn, results
+
+def _plan(out: str, scidx_fns: list, ref_names: list, provenances: dict, names: dict, matrix: bool):
+    if not os.path.exists(out):
+        return [(scidx_fn, list(range(len(ref_names)))) for scidx_fn in scidx_fns]
+    tasks = []
+    with stage_profiler.lock(SoftFileLock('{}.lock'.format(out))):
+        with h5py.File(out, 'r') as h5:
+            for scidx_fn in scidx_fns:
+                sample_id, target_cond = names[scidx_fn]
+                rep_group = h5.get('{}/{}'.format(target_cond, sample_id))
+                todo = [i for i, ref_name in enumerate(ref_names)
+                        if not is_current(None if rep_group is None else rep_group.get(ref_name),
+                                          provenances[scidx_fn][i], matrix)]
+                tasks.append((scidx_fn, todo))
+    return tasks
+
+def _write_batch(out: str, batch: list, ref_names: list, provenances: dict, labels: dict, controls: set):
+    with stage_profiler.stage('write_h5', rows=sum(len(results) for _, results in batch)):
+        with stage_profiler.lock(SoftFileLock('{}.lock'.format(out))):
+            with h5py.File(out, 'a') as h5:
+                for scidx_fn, results in batch:
+                    sample_id, target, cond = labels[scidx_fn]
+                    rep_group = init_sample_group(h5, '{}-{}'.format(target, cond), sample_id,
+                                                  control=scidx_fn in controls, target=target, condition=cond)
+                    for i, forward_comp, reverse_comp, site_mats in results:
+                        write_ref_group(rep_group, ref_names[i], forward_comp, reverse_comp, site_mats=site_mats,
+                                        provenance=provenances[scidx_fn][i])
+
+def batch_pileup(scidx_fns: list, bed_fns: list, chrom_sizes: str, out: str, controls: list = (),
+                 ref_pattern: re.Pattern = re.compile(r'(.+)_(\d+)bp.bed'),
+                 sample_pattern: re.Pattern = re.compile(r'(\d+)_(.+?)_i5006_BY4741_-_YPD_(.+?)_XO_FilteredBAM'),
+                 processes: int = None, batch_size: int = 8, cache: bool = False, matrix: bool = False,
+                 resume: bool = False, dry_run: bool = False, content_hash: bool = False, consolidate: bool = False,
+                 sample_table: str = None):
+    """
+    scidx_fns: list
+        List of paths to scidx files
+    bed_fns: list
+        List of paths to bed files
+    chrom_sizes: str
+        Path to the chrom.sizes file
+    out: str
+        Path to the output h5 file
+    controls: list
+        Paths of the scidx files that should be formatted as control pileups
+    ref_pattern: re.Pattern
+        Regular expression pattern to extract the reference name from the bed file name
+    sample_pattern: re.Pattern
+        Regular expression pattern to extract the replicate, target, and condition from the scidx file name
+    processes: int
+        Number of worker processes (defaults to the number of CPUs)
+    batch_size: int
+        Number of samples written to the h5 file per open
+    cache: bool
+        If True, read the tag counts from memory-mapped binary caches of the scidx files, (re)building them if needed
+    matrix: bool
+        If True, also store the per-site tag matrices (forward_matrix, reverse_matrix) and their site IDs (sites)
+    resume: bool
+        If True, skip (sample, reference) pairs that were already computed from the same input files
+    dry_run: bool
+        If True, only report which (sample, reference) pairs would be computed
+    content_hash: bool
+        If True, identify input files by a hash of their contents instead of their size and mtime
+    consolidate: bool
+        If True, rebuild the consolidated (samples, strands, positions) layout once all pileups are written
+    sample_table: str
+        Path to a sample table (see bulk_pileup.read_sample_table) to look up the target and condition by sample ID
+        instead of using sample_pattern
+
+    The bed files are parsed once and shared with a pool of workers that each pile up one sample at a time. All h5
+    writes happen in this process, batch_size samples per lock acquisition.
+    """
+    samples = read_sample_table(sample_table) if sample_table is not None else None
+    labels = {scidx_fn: parse_sample_labels(scidx_fn, sample_pattern, samples) for scidx_fn in scidx_fns}
+    names = {scidx_fn: (sample_id, '{}-{}'.format(target, cond))
+             for scidx_fn, (sample_id, target, cond) in labels.items()}
+    ref_names = [parse_ref(bed_fn, ref_pattern)[0] for bed_fn in bed_fns]
+    sizes_signature = file_signature(chrom_sizes, content_hash=content_hash)
+    bed_signatures = [file_signature(bed_fn, content_hash=content_hash) for bed_fn in bed_fns]
+    provenances = {}
+    for scidx_fn in scidx_fns:
+        scidx_signature = file_signature(scidx_fn, content_hash=content_hash)
+        provenances[scidx_fn] = [{'scidx': scidx_signature, 'chrom_sizes': sizes_signature, 'bed': bed_signature}
+                                 for bed_signature in bed_signatures]
+
+    if resume or dry_run:
+        with stage_profiler.stage('plan', rows=len(scidx_fns)):
+            tasks = _plan(out, scidx_fns, ref_names, provenances, names, matrix)
+    else:
+        tasks = [(scidx_fn, list(range(len(bed_fns)))) for scidx_fn in scidx_fns]
+    tasks = [(scidx_fn, todo) for scidx_fn, todo in tasks if todo]
+    if dry_run:
+        for scidx_fn, todo in tasks:
+            sample_id, target_cond = names[scidx_fn]
+            for i in todo:
+                print('{}/{}/{}'.format(target_cond, sample_id, ref_names[i]))
+        return
+    if not tasks:
+        if consolidate:
+            consolidate_h5(out)
+        return
+
+    sizes = read_chrom_sizes(chrom_sizes)
+    needed = set(i for _, todo in tasks for i in todo)
+    refs = [None] * len(bed_fns)
+    for i, bed_fn in enumerate(bed_fns):
+        if i not in needed:
+            continue
+        print(bed_fn)
+        ref_name, length = parse_ref(bed_fn, ref_pattern)
+        with stage_profiler.stage('read_bed', bytes_read=os.path.getsize(bed_fn)) as stage:
+            bed = read_bed(bed_fn)
+            stage.add(rows=len(bed['start']))
+        refs[i] = (ref_name, length, bed, np.flatnonzero(in_bounds(bed, sizes)))
+    controls = set(controls)
+
+    batch = []
+    # the workers are not profiled, so this stage is the wall time of the pool (including the batch writes)
+    with stage_profiler.stage('pileup', rows=len(tasks)):
+        with Pool(processes, initializer=_init_worker, initargs=(sizes, refs, matrix, cache)) as pool:
+            for result in pool.imap_unordered(_pileup_sample, tasks):
+                print(result[0])
+                batch.append(result)
+                if len(batch) >= batch_size:
+                    _write_batch(out, batch, ref_names, provenances, labels, controls)
+                    batch = []
+    if batch:
+        _write_batch(out, batch, ref_names, provenances, labels, controls)
+    if consolidate:
+        with stage_profiler.stage('consolidate'):
+            consolidate_h5(out)
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('scidx_fns', help='file containing list of scidx files')
+    parser.add_argument('bed_fns', help='file containing list of bed files')
+    parser.add_argument('chrom_sizes', help='chrom.sizes file')
+    parser.add_argument('out', help='output h5 file')
+    parser.add_argument('--control', '-c', action='store_true', help='output all samples as control pileups')
+    parser.add_argument('--controls', default=None, help='file containing list of scidx files to output as control pileups')
+    parser.add_argument('--ref_pattern', '-rp', default='(.+)_(\d+)bp.bed',
+                        help='regular expression pattern to extract the reference name row width from the bed file name')
+    parser.add_argument('--sample_pattern', '-sp', default='(\d+)_(.+?)_i5006_BY4741_-_YPD_(.+?)_XO_FilteredBAM',
+                        help='regular expression pattern to extract the ID, target, and condition from the scidx file name')
+    parser.add_argument('--processes', '-p', type=int, default=None, help='number of worker processes')
+    parser.add_argument('--batch_size', '-b', type=int, default=8, help='number of samples written per h5 open')
+    parser.add_argument('--matrix', '-m', action='store_true', help='also store the per-site tag matrices')
+    parser.add_argument('--cache', action='store_true', help='read tag counts from binary caches of the scidx files')
+    parser.add_argument('--resume', '-r', action='store_true', help='skip (sample, reference) pairs that are up to date')
+    parser.add_argument('--dry_run', '-n', action='store_true', help='only list the (sample, reference) pairs to compute')
+    parser.add_argument('--content_hash', action='store_true', help='compare input files by content hash instead of mtime')
+    parser.add_argument('--consolidate', action='store_true', help='also write the consolidated per-reference layout')
+    parser.add_argument('--sample_table', '-st', default=None,
+                        help='table of sample IDs, targets, and conditions to use instead of the sample pattern')
+    stage_profiler.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with open(args.scidx_fns) as f:
+        scidx_fns = f.read().strip().split('\n')
+    with open(args.bed_fns) as f:
+        bed_fns = f.read().strip().split('\n')
+    if args.control:
+        controls = scidx_fns
+    elif args.controls:
+        with open(args.controls) as f:
+            controls = f.read().strip().split('\n')
+    else:
+        controls = []
+    with stage_profiler.profiler_from_args('batch_pileup', args):
+        batch_pileup(scidx_fns, bed_fns, args.chrom_sizes, args.out, controls=controls,
+                     ref_pattern=re.compile(args.ref_pattern), sample_pattern=re.compile(args.sample_pattern),
+                     processes=args.processes, batch_size=args.batch_size, cache=args.cache, matrix=args.matrix,
+                     resume=args.resume, dry_run=args.dry_run, content_hash=args.content_hash,
+                     consolidate=args.consolidate, sample_table=args.sample_table)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,373 @@
 import numpy as np
 import os
+import sys
+import hashlib
 import re
 import h5py
 from filelock import SoftFileLock
 import argparse
+from scidx_cache import read_chrom_sizes, parse_scidx, load_scidx, default_cache_dir, is_stale, cache_size
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_utils'))
+import stage_profiler
+
+_max_chunk_elements = 1 << 22
+
+def read_bed(bed_fn: str):
+    """
+    bed_fn: str
+        Path to the bed file
+
+    Returns a dict of arrays with the chromosome, start, end, name, and strand (True if minus) of every interval
+    """
+    contigs, starts, ends, names, minus = [], [], [], [], []
+    with open(bed_fn, 'r') as f:
+        for line in f:
+            line = line.strip().split('\t')
+            contigs.append(line[0])
+            starts.append(int(line[1]))
+            ends.append(int(line[2]))
+            names.append(line[3])
+            minus.append(line[5] == '-')
+    return {'chrom': np.array(contigs, dtype=str), 'start': np.array(starts, dtype=np.int64),
+            'end': np.array(ends, dtype=np.int64), 'name': np.array(names, dtype=str),
+            'minus': np.array(minus, dtype=bool)}
+
+def in_bounds(bed: dict, sizes: dict):
+    """
+    bed: dict
+        Intervals returned by read_bed
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+
+    Returns a boolean mask of the intervals that lie within their chromosome, reporting the ones that are skipped
+    """
+    contigs, contig_idx = np.unique(bed['chrom'], return_inverse=True)
+    chrom_sizes = np.array([sizes[contig] for contig in contigs], dtype=np.int64)[contig_idx]
+    mask = (bed['start'] >= 1) & (bed['end'] <= chrom_sizes - 1)
+    for i in np.flatnonzero(~mask):
+        print('Skipping {}:{}-{} (out of bounds)'.format(bed['chrom'][i], bed['start'][i], bed['end'][i]))
+    return mask
+
+def iter_site_counts(chrom_dict: dict, bed: dict, sites: np.ndarray, length: int):
+    """
+    chrom_dict: dict
+        Dict mapping chromosome names to (size, 2) arrays of forward and reverse tag counts (or the
+        scidx_cache.SparseCounts of a sparse cache)
+    bed: dict
+        Intervals returned by read_bed
+    sites: np.ndarray
+        Indices of the intervals to gather (e.g. the in-bounds ones)
+    length: int
+        Width of every interval
+
+    Yields (sites, forward, reverse) for batches of intervals grouped by chromosome and strand, where forward and
+    reverse are (n_sites, length) strand-aware tag count matrices oriented 5' to 3' relative to each interval
+    """
+    widths = bed['end'][sites] - bed['start'][sites]
+    if np.any(widths != length):
+        raise ValueError('Interval widths do not match the reference width ({}bp)'.format(length))
+    offsets = np.arange(length)
+    chunk_size = max(1, _max_chunk_elements // max(length, 1))
+    contigs, contig_idx = np.unique(bed['chrom'][sites], return_inverse=True)
+    group_idx = contig_idx * 2 + bed['minus'][sites]
+    order = np.argsort(group_idx, kind='stable')
+    bounds = np.searchsorted(group_idx[order], np.arange(len(contigs) * 2 + 1))
+    for g in range(len(contigs) * 2):
+        group = sites[order[bounds[g]:bounds[g + 1]]]
+        counts = chrom_dict[contigs[g // 2]]
+        minus = g % 2 == 1
+        for i in range(0, len(group), chunk_size):
+            chunk = group[i:i + chunk_size]
+            if minus:
+                idx = bed['end'][chunk, None] - 1 - offsets
+                yield chunk, counts[idx, 1], counts[idx, 0]
+            else:
+                idx = bed['start'][chunk, None] + offsets
+                yield chunk, counts[idx, 0], counts[idx, 1]
+
+def composite(chrom_dict: dict, sizes: dict, bed: dict, length: int, sites: np.ndarray = None):
+    """
+    chrom_dict: dict
+        Dict mapping chromosome names to (size, 2) arrays of forward and reverse tag counts
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+    bed: dict
+        Intervals returned by read_bed
+    length: int
+        Width of every interval
+    sites: np.ndarray
+        Indices of the in-bounds intervals, computed with in_bounds if None
+
+    Returns the strand-aware forward and reverse composites summed over all in-bounds intervals
+    """
+    forward_comp = np.zeros(length, dtype=np.int32)
+    reverse_comp = np.zeros(length, dtype=np.int32)
+    if sites is None:
+        sites = np.flatnonzero(in_bounds(bed, sizes))
+    for _, forward, reverse in iter_site_counts(chrom_dict, bed, sites, length):
+        forward_comp += forward.sum(axis=0, dtype=np.int32)
+        reverse_comp += reverse.sum(axis=0, dtype=np.int32)
+    return forward_comp, reverse_comp
+
+def site_matrices(chrom_dict: dict, sizes: dict, bed: dict, length: int, sites: np.ndarray = None):
+    """
+    chrom_dict: dict
+        Dict mapping chromosome names to (size, 2) arrays of forward and reverse tag counts
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+    bed: dict
+        Intervals returned by read_bed
+    length: int
+        Width of every interval
+    sites: np.ndarray
+        Indices of the in-bounds intervals, computed with in_bounds if None
+
+    Returns the names of the in-bounds intervals and their (n_sites, length) strand-aware forward and reverse tag
+    matrices, in bed file order
+    """
+    if sites is None:
+        sites = np.flatnonzero(in_bounds(bed, sizes))
+    rows = np.empty(len(bed['start']), dtype=np.int64)
+    rows[sites] = np.arange(len(sites))
+    forward_mat = np.empty((len(sites), length), dtype=np.int32)
+    reverse_mat = np.empty((len(sites), length), dtype=np.int32)
+    for chunk, forward, reverse in iter_site_counts(chrom_dict, bed, sites, length):
+        forward_mat[rows[chunk]] = forward
+        reverse_mat[rows[chunk]] = reverse
+    return bed['name'][sites], forward_mat, reverse_mat
+
+def write_site_matrices(ref_group: h5py.Group, names: np.ndarray, forward_mat: np.ndarray, reverse_mat: np.ndarray,
+                        chunk_rows: int = 256, compression: str = 'gzip'):
+    """
+    ref_group: h5py.Group
+        Reference group to write the matrices to
+    names: np.ndarray
+        Site IDs of the matrix rows
+    forward_mat: np.ndarray
+        (n_sites, length) forward tag matrix
+    reverse_mat: np.ndarray
+        (n_sites, length) reverse tag matrix
+    chunk_rows: int
+        Number of sites per HDF5 chunk
+    compression: str
+        HDF5 compression filter
+    """
+    chunks = (max(1, min(chunk_rows, len(names))), max(1, forward_mat.shape[1]))
+    for key, mat in (('forward_matrix', forward_mat), ('reverse_matrix', reverse_mat)):
+        ref_group.create_dataset(key, data=mat, chunks=chunks, compression=compression, shuffle=True)
+    ref_group.create_dataset('sites', data=np.asarray(names, dtype=object), dtype=h5py.string_dtype())
+
+def file_signature(fn: str, content_hash: bool = False):
+    """
+    fn: str
+        Path to the file
+    content_hash: bool
+        If True, hash the file contents instead of using its size and mtime
+
+    Returns a string identifying the current version of the file
+    """
+    if content_hash:
+        h = hashlib.sha1()
+        with open(fn, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        return 'sha1:{}'.format(h.hexdigest())
+    st = os.stat(fn)
+    return 'stat:{}:{}'.format(st.st_size, st.st_mtime_ns)
+
+def is_current(ref_group: h5py.Group, provenance: dict, matrix: bool = False):
+    """
+    ref_group: h5py.Group
+        Reference group, or None if it does not exist
+    provenance: dict
+        Input file signatures the reference group should have been computed from
+    matrix: bool
+        If True, the per-site tag matrices are also required
+
+    Returns True if the reference group is complete and was computed from the same inputs
+    """
+    if ref_group is None or 'forward' not in ref_group or 'reverse' not in ref_group:
+        return False
+    if matrix and 'forward_matrix' not in ref_group:
+        return False
+    return all(ref_group.attrs.get(key) == value for key, value in provenance.items())
+
+def stale_refs(out: str, target_cond: str, sample_id: str, ref_names: list, provenances: list, matrix: bool = False):
+    """
+    out: str
+        Path to the output h5 file
+    target_cond: str
+        Target-condition group name
+    sample_id: str
+        Sample ID
+    ref_names: list
+        Reference names
+    provenances: list
+        Input file signatures of each reference
+    matrix: bool
+        If True, the per-site tag matrices are also required
+
+    Returns the indices of the references that are missing or out of date in the output h5 file
+    """
+    if not os.path.exists(out):
+        return list(range(len(ref_names)))
+    with stage_profiler.lock(SoftFileLock('{}.lock'.format(out))):
+        with h5py.File(out, 'r') as h5:
+            rep_group = h5.get('{}/{}'.format(target_cond, sample_id))
+            return [i for i, (ref_name, provenance) in enumerate(zip(ref_names, provenances))
+                    if not is_current(None if rep_group is None else rep_group.get(ref_name), provenance, matrix)]
+
+def pileup_ref(chrom_dict: dict, sizes: dict, bed: dict, length: int, matrix: bool = False,
+               sites: np.ndarray = None):
+    """
+    chrom_dict: dict
+        Dict mapping chromosome names to (size, 2) arrays of forward and reverse tag counts
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+    bed: dict
+        Intervals returned by read_bed
+    length: int
+        Width of every interval
+    matrix: bool
+        If True, also return the per-site tag matrices
+    sites: np.ndarray
+        Indices of the in-bounds intervals, computed with in_bounds if None
+
+    Returns the forward and reverse composites and, if matrix is True, the (names, forward_mat, reverse_mat) tuple
+    from site_matrices (otherwise None)
+    """
+    if matrix:
+        site_mats = site_matrices(chrom_dict, sizes, bed, length, sites=sites)
+        return site_mats[1].sum(axis=0, dtype=np.int32), site_mats[2].sum(axis=0, dtype=np.int32), site_mats
+    forward_comp, reverse_comp = composite(chrom_dict, sizes, bed, length, sites=sites)
+    return forward_comp, reverse_comp, None
+
+def read_sample_table(fn: str):
+    """
+    fn: str
+        Path to a tab-separated sample table with id, target, and condition columns (e.g. written by
+        pegr_utils/pegr_client.py)
+
+    Returns a dict mapping sample IDs to (target, condition) pairs
+    """
+    with open(fn) as f:
+        header = f.readline().rstrip('\n').split('\t')
+        id_col, target_col, cond_col = (header.index(column) for column in ('id', 'target', 'condition'))
+        samples = {}
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) > 1:
+                samples[row[id_col]] = (row[target_col], row[cond_col])
+    return samples
+
+def parse_sample_labels(scidx_fn: str, sample_pattern: re.Pattern, samples: dict = None):
+    """
+    Returns the sample ID, target, and condition of a scidx file. If samples (see read_sample_table) is given, the
+    target and condition are looked up by the sample ID at the start of the file name instead of being parsed with
+    sample_pattern.
+    """
+    if samples is not None:
+        match = re.match(r'\d+', os.path.basename(scidx_fn))
+        if match is None or match.group() not in samples:
+            raise KeyError('No sample table entry for {}'.format(scidx_fn))
+        target, cond = samples[match.group()]
+        return match.group(), target, cond
+    sample_id, target, cond = sample_pattern.match(os.path.basename(scidx_fn)).groups()
+    return sample_id, target, cond
+
+def parse_sample(scidx_fn: str, sample_pattern: re.Pattern, samples: dict = None):
+    """
+    Returns the sample ID and target-condition group name of a scidx file (see parse_sample_labels)
+    """
+    sample_id, target, cond = parse_sample_labels(scidx_fn, sample_pattern, samples)
+    return sample_id, '{}-{}'.format(target, cond)
+
+def mark_modified(h5: h5py.File):
+    """
+    Bump the generation of a pileup h5 file and drop its consolidated layout, which no longer matches the per-sample
+    groups (see pileup_store.consolidate)
+    """
+    h5.attrs['generation'] = int(h5.attrs.get('generation', 0)) + 1
+    if 'consolidated' in h5:
+        del h5['consolidated']
+
+def parse_ref(bed_fn: str, ref_pattern: re.Pattern):
+    """
+    Returns the reference name and interval width of a bed file
+    """
+    ref_name, length = ref_pattern.match(os.path.basename(bed_fn)).groups()
+    return ref_name, int(length)
+
+def init_sample_group(h5: h5py.File, target_cond: str, sample_id: str, control: bool = False, target: str = None,
+                      condition: str = None):
+    """
+    h5: h5py.File
+        Output h5 file
+    target_cond: str
+        Target-condition group name
+    sample_id: str
+        Sample ID
+    control: bool
+        If True, add the target-condition to the list of controls
+    target: str
+        Target, stored as an attribute of the sample group (so it is not parsed back out of target_cond)
+    condition: str
+        Condition, stored as an attribute of the sample group
+
+    Returns the sample group, creating it if needed
+    """
+    if target_cond not in h5 or sample_id not in h5[target_cond]:
+        mark_modified(h5)
+    rep_group = h5.require_group(target_cond).require_group(sample_id)
+    if target is not None:
+        rep_group.attrs['target'] = target
+    if condition is not None:
+        rep_group.attrs['condition'] = condition
+    if control:
+        controls = set(h5['controls'].asstr()[:]) if 'controls' in h5 else set()
+        if target_cond not in controls:
+            controls.add(target_cond)
+            if 'controls' in h5:
+                del h5['controls']
+            h5.create_dataset('controls', data=sorted(controls), dtype=h5py.string_dtype())
+    return rep_group
+
+def write_ref_group(rep_group: h5py.Group, ref_name: str, forward_comp: np.ndarray, reverse_comp: np.ndarray,
+                    site_mats: tuple = None, provenance: dict = None):
+    """
+    rep_group: h5py.Group
+        Sample group
+    ref_name: str
+        Reference name
+    forward_comp: np.ndarray
+        Forward composite
+    reverse_comp: np.ndarray
+        Reverse composite
+    site_mats: tuple
+        (names, forward_mat, reverse_mat) per-site tag matrices, see site_matrices
+    provenance: dict
+        Input file signatures stored as attributes of the reference group
+
+    Returns the reference group, replacing any previous results
+    """
+    mark_modified(rep_group.file)
+    ref_group = rep_group.require_group(ref_name)
+    for key in ('forward', 'reverse', 'forward_matrix', 'reverse_matrix', 'sites'):
+        if key in ref_group:
+            del ref_group[key]
+    ref_group['forward'] = forward_comp
+    ref_group['reverse'] = reverse_comp
+    if site_mats is not None:
+        write_site_matrices(ref_group, *site_mats)
+    if provenance is not None:
+        ref_group.attrs.update(provenance)
+    return ref_group
 
 def pileup(scidx_fn: str, bed_fns: list, chrom_sizes: str, out: str, control: bool = False,
            ref_pattern: re.Pattern = re.compile(r'(.+)_(\d+)bp.bed'),
-           sample_pattern: re.Pattern = re.compile(r'(\d+)_(.+?)_i5006_BY4741_-_YPD_(.+?)_XO_FilteredBAM')):
+           sample_pattern: re.Pattern = re.compile(r'(\d+)_(.+?)_i5006_BY4741_-_YPD_(.+?)_XO_FilteredBAM'),
+           cache: bool = False, cache_dir: str = None, matrix: bool = False, resume: bool = False,
+           dry_run: bool = False, content_hash: bool = False, sample_table: str = None):
     """
     scidx_fn: str
         Path to the scidx file
@@ -23,77 +383,76 @@ def pileup(scidx_fn: str, bed_fns: list, chrom_sizes: str, out: str, control: bo
         Regular expression pattern to extract the reference name from the bed file name
     sample_pattern: re.Pattern
         Regular expression pattern to extract the replicate, target, and condition from the scidx file name
+    cache: bool
+        If True, read the tag counts from a memory-mapped binary cache of the scidx file, (re)building it if needed
+    cache_dir: str
+        Path to the cache directory (defaults to <scidx_fn>.cache)
+    matrix: bool
+        If True, also store the per-site tag matrices (forward_matrix, reverse_matrix) and their site IDs (sites)
+    resume: bool
+        If True, skip references that were already computed from the same scidx, bed, and chrom.sizes files
+    dry_run: bool
+        If True, only report which references would be computed
+    content_hash: bool
+        If True, identify input files by a hash of their contents instead of their size and mtime
+    sample_table: str
+        Path to a sample table (see read_sample_table) to look up the target and condition by sample ID instead of
+        using sample_pattern
     """
-    sizes = {}
-    chrom_dict = {}
-    with open(chrom_sizes) as f:
-        for line in f:
-            chrom, size = line.strip().split()
-            sizes[chrom] = int(size)
-            chrom_dict[chrom] = np.zeros((sizes[chrom], 2), dtype=np.int32)
-    
-    with open(scidx_fn, 'r') as f:
-        contig = None
-        f.readline()
-        f.readline()
-        for line in f:
-            line = line.strip().split('\t')
-            contig = line[0]
-            pos = int(line[1]) - 1
-            chrom_dict[contig][pos, 0] = int(line[2])
-            chrom_dict[contig][pos, 1] = int(line[3])
-    
-    sample_id, target, cond = sample_pattern.match(os.path.basename(scidx_fn)).groups()
+    samples = read_sample_table(sample_table) if sample_table is not None else None
+    sample_id, target, cond = parse_sample_labels(scidx_fn, sample_pattern, samples)
+    target_cond = '{}-{}'.format(target, cond)
+    refs = [(bed_fn, *parse_ref(bed_fn, ref_pattern)) for bed_fn in bed_fns]
+    signatures = {'scidx': file_signature(scidx_fn, content_hash=content_hash),
+                  'chrom_sizes': file_signature(chrom_sizes, content_hash=content_hash)}
+    provenances = [dict(signatures, bed=file_signature(bed_fn, content_hash=content_hash)) for bed_fn, _, _ in refs]
+    todo = list(range(len(refs)))
+    if resume or dry_run:
+        todo = stale_refs(out, target_cond, sample_id, [ref_name for _, ref_name, _ in refs], provenances,
+                          matrix=matrix)
+    if dry_run:
+        for i in todo:
+            print('{}/{}/{}'.format(target_cond, sample_id, refs[i][1]))
+        return
+    if not todo:
+        return
+
+    sizes = read_chrom_sizes(chrom_sizes)
+    with stage_profiler.stage('load_tags') as stage:
+        if cache:
+            cache_dir = cache_dir or default_cache_dir(scidx_fn)
+            # the scidx (or BAM) file is only read if the cache has to be rebuilt
+            if is_stale(scidx_fn, sizes, cache_dir):
+                stage.add(bytes_read=os.path.getsize(scidx_fn))
+            chrom_dict = load_scidx(scidx_fn, sizes, cache_dir=cache_dir)
+            stage.add(bytes_read=cache_size(cache_dir))
+        else:
+            chrom_dict = parse_scidx(scidx_fn, sizes)
+            stage.add(bytes_read=os.path.getsize(scidx_fn))
+
     lock = SoftFileLock('{}.lock'.format(out))
-    with lock:
-        with h5py.File(out, 'a') as h5:
-            target_cond = '{}-{}'.format(target, cond)
-            if h5.get(target_cond) is None:
-                h5.create_group(target_cond)
-            target_group = h5[target_cond]
-            if target_group.get(sample_id) is None:
-                target_group.create_group(sample_id)
-            
-            if control:
-                if h5.get('controls') is None:
-                    h5.create_group('controls')
-                controls = set(h5['controls'][:])
-                controls.add(target_cond)
-                h5['controls'] = list(controls)
-
-    for bed_fn in bed_fns:
-        print(bed_fn)
-        ref_name, length = ref_pattern.match(os.path.basename(bed_fn)).groups()
-        length = int(length)
-        forward_comp = np.zeros(length, dtype=np.int32)
-        reverse_comp = np.zeros(length, dtype=np.int32)
-        with open(bed_fn, 'r') as f:
-            for line in f:
-                line = line.strip().split('\t')
-                contig = line[0]
-                start = int(line[1])
-                end = int(line[2])
-                if start < 1 or end > sizes[contig] - 1:
-                    print('Skipping {}:{}-{} (out of bounds)'.format(contig, start, end))
-                    continue
-                if line[5] == '-':
-                    forward_comp += chrom_dict[contig][end - 1:start - 1:-1, 1]
-                    reverse_comp += chrom_dict[contig][end - 1:start - 1:-1, 0]
-                else:
-                    forward_comp += chrom_dict[contig][start:end, 0]
-                    reverse_comp += chrom_dict[contig][start:end, 1]
-        
-        with lock:
+    with stage_profiler.stage('write_h5'):
+        with stage_profiler.lock(lock):
             with h5py.File(out, 'a') as h5:
-                rep_group = h5[target_cond][sample_id]
-                if rep_group.get(ref_name) is None:
-                    rep_group.create_group(ref_name)
-                ref_group = rep_group[ref_name]
-                ref_group['forward'] = forward_comp
-                ref_group['reverse'] = reverse_comp
+                init_sample_group(h5, target_cond, sample_id, control=control, target=target, condition=cond)
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
+    for i in todo:
+        bed_fn, ref_name, length = refs[i]
+        print(bed_fn)
+        with stage_profiler.stage('read_bed', bytes_read=os.path.getsize(bed_fn)) as stage:
+            bed = read_bed(bed_fn)
+            stage.add(rows=len(bed['start']))
+        with stage_profiler.stage('pileup', rows=len(bed['start'])):
+            forward_comp, reverse_comp, site_mats = pileup_ref(chrom_dict, sizes, bed, length, matrix=matrix)
+
+        with stage_profiler.stage('write_h5', rows=1):
+            with stage_profiler.lock(lock):
+                with h5py.File(out, 'a') as h5:
+                    write_ref_group(h5[target_cond][sample_id], ref_name, forward_comp, reverse_comp,
+                                    site_mats=site_mats, provenance=provenances[i])
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('scidx_fn', help='scidx file')
     parser.add_argument('bed_fns', help='file containing list of bed files')
     parser.add_argument('chrom_sizes', help='chrom.sizes file')
@@ -103,9 +462,24 @@ if __name__ == '__main__':
                         help='regular expression pattern to extract the reference name row width from the bed file name')
     parser.add_argument('--sample_pattern', '-sp', default='(\d+)_(.+?)_i5006_BY4741_-_YPD_(.+?)_XO_FilteredBAM',
                         help='regular expression pattern to extract the ID, target, and condition from the scidx file name')
-    args = parser.parse_args()
+    parser.add_argument('--matrix', '-m', action='store_true', help='also store the per-site tag matrices')
+    parser.add_argument('--cache', action='store_true', help='read tag counts from a binary cache of the scidx file')
+    parser.add_argument('--resume', '-r', action='store_true', help='skip references that are already up to date')
+    parser.add_argument('--dry_run', '-n', action='store_true', help='only list the references that would be computed')
+    parser.add_argument('--content_hash', action='store_true', help='compare input files by content hash instead of mtime')
+    parser.add_argument('--cache_dir', default=None, help='scidx cache directory (defaults to <scidx_fn>.cache)')
+    parser.add_argument('--sample_table', '-st', default=None,
+                        help='table of sample IDs, targets, and conditions to use instead of the sample pattern')
+    stage_profiler.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
 
     with open(args.bed_fns) as f:
         bed_fns = f.read().strip().split('\n')
-    pileup(args.scidx_fn, bed_fns, args.chrom_sizes, args.out, control=args.control,
-           ref_pattern=re.compile(args.ref_pattern), sample_pattern=re.compile(args.sample_pattern))
\ No newline at end of file
+    with stage_profiler.profiler_from_args('bulk_pileup', args):
+        pileup(args.scidx_fn, bed_fns, args.chrom_sizes, args.out, control=args.control,
+               ref_pattern=re.compile(args.ref_pattern), sample_pattern=re.compile(args.sample_pattern),
+               cache=args.cache, cache_dir=args.cache_dir, matrix=args.matrix, resume=args.resume,
+               dry_run=args.dry_run, content_hash=args.content_hash, sample_table=args.sample_table)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+import numpy as np
+import h5py
+from filelock import SoftFileLock
+import argparse
+
+_reserved = ('controls', 'consolidated')
+
+def _walk_samples(h5: h5py.File):
+    controls = set(h5['controls'].asstr()[:]) if isinstance(h5.get('controls'), h5py.Dataset) else set()
+    for target_cond, target_group in h5.items():
+        if target_cond in _reserved or not isinstance(target_group, h5py.Group):
+            continue
+        for sample_id, rep_group in target_group.items():
+            yield target_cond, sample_id, target_cond in controls, rep_group
+
+def _labels(target_cond: str, rep_group: h5py.Group):
+    # target and condition as stored by init_sample_group, or split on the last '-' for files written without them
+    # (targets may contain '-', conditions are assumed not to)
+    target, _, condition = target_cond.rpartition('-')
+    return rep_group.attrs.get('target', target), rep_group.attrs.get('condition', condition)
+
+def generation(h5: h5py.File):
+    """
+    Number of writes to the per-sample groups of a pileup h5 file (see bulk_pileup.mark_modified)
+    """
+    return int(h5.attrs.get('generation', 0))
+
+def is_consolidated(h5: h5py.File):
+    """
+    Returns True if h5 has a consolidated layout that was built from its current per-sample groups
+    """
+    group = h5.get('consolidated')
+    return group is not None and group.attrs.get('generation') == generation(h5)
+
+def consolidate(fn: str, out: str = None, chunk_samples: int = 64, compression: str = 'gzip'):
+    """
+    fn: str
+        Path to a pileup h5 file in the target-cond/sample_id/ref/forward|reverse layout
+    out: str
+        Path to the output h5 file (defaults to adding the consolidated layout to fn)
+    chunk_samples: int
+        Number of samples per HDF5 chunk
+    compression: str
+        HDF5 compression filter
+
+    Writes a consolidated group with one (samples, 2, positions) array per reference under consolidated/refs/<ref>,
+    a boolean consolidated/refs/<ref>/present mask of the samples that have that reference, and sample index
+    columns (sample_id, target_cond, target, condition, control) under consolidated/samples. The consolidated group
+    records the generation of fn it was built from; any later write to fn makes PileupStore ignore it.
+    """
+    out = out or fn
+    with SoftFileLock('{}.lock'.format(fn)):
+        if out == fn:
+            with h5py.File(fn, 'a') as h5:
+                _write_consolidated(h5, h5, chunk_samples, compression)
+        else:
+            with h5py.File(fn, 'r') as h5, h5py.File(out, 'a') as h5_out:
+                _write_consolidated(h5, h5_out, chunk_samples, compression)
+
+def _write_consolidated(h5: h5py.File, h5_out: h5py.File, chunk_samples: int, compression: str):
+    samples = list(_walk_samples(h5))
+    ref_lengths = {}
+    for _, _, _, rep_group in samples:
+        for ref_name, ref_group in rep_group.items():
+            ref_lengths.setdefault(ref_name, len(ref_group['forward']))
+
+    if 'consolidated' in h5_out:
+        del h5_out['consolidated']
+    group = h5_out.create_group('consolidated')
+    group.attrs['generation'] = generation(h5)
+    if h5_out is not h5:
+        h5_out.attrs['generation'] = generation(h5)
+    index = group.create_group('samples')
+    str_dtype = h5py.string_dtype()
+    labels = [_labels(target_cond, rep_group) for target_cond, _, _, rep_group in samples]
+    index.create_dataset('sample_id', data=[sample_id for _, sample_id, _, _ in samples], dtype=str_dtype)
+    index.create_dataset('target_cond', data=[target_cond for target_cond, _, _, _ in samples], dtype=str_dtype)
+    index.create_dataset('target', data=[target for target, _ in labels], dtype=str_dtype)
+    index.create_dataset('condition', data=[condition for _, condition in labels], dtype=str_dtype)
+    index.create_dataset('control', data=np.array([control for _, _, control, _ in samples], dtype=bool))
+
+    refs = group.create_group('refs')
+    n = len(samples)
+    for ref_name, length in ref_lengths.items():
+        data = np.zeros((n, 2, length), dtype=np.int32)
+        present = np.zeros(n, dtype=bool)
+        for row, (_, _, _, rep_group) in enumerate(samples):
+            ref_group = rep_group.get(ref_name)
+            if ref_group is None or 'forward' not in ref_group:
+                continue
+            data[row, 0] = ref_group['forward'][:]
+            data[row, 1] = ref_group['reverse'][:]
+            present[row] = True
+        ref_out = refs.create_group(ref_name)
+        ref_out.create_dataset('data', data=data, chunks=(max(1, min(chunk_samples, n)), 2, max(1, length)),
+                               compression=compression, shuffle=True)
+        ref_out.create_dataset('present', data=present)
+
+class PileupStore:
+    """
+    Reader for pileup h5 files. Uses the consolidated layout if it is present and up to date (see is_consolidated),
+    otherwise falls back to walking the target-cond/sample_id/ref groups.
+
+    samples: dict
+        Index columns (sample_id, target_cond, target, condition, control) with one row per sample
+    refs: list
+        Reference names
+    """
+
+    def __init__(self, fn: str):
+        self.h5 = h5py.File(fn, 'r')
+        self.consolidated = is_consolidated(self.h5)
+        if self.consolidated:
+            index = self.h5['consolidated/samples']
+            self.samples = {key: index[key].asstr()[:] if key != 'control' else index[key][:]
+                            for key in ('sample_id', 'target_cond', 'target', 'condition', 'control')}
+            self.refs = list(self.h5['consolidated/refs'])
+            self._groups = None
+        else:
+            walked = list(_walk_samples(self.h5))
+            labels = [_labels(target_cond, rep_group) for target_cond, _, _, rep_group in walked]
+            self.samples = {'sample_id': np.array([sample_id for _, sample_id, _, _ in walked], dtype=str),
+                            'target_cond': np.array([target_cond for target_cond, _, _, _ in walked], dtype=str),
+                            'target': np.array([target for target, _ in labels], dtype=str),
+                            'condition': np.array([condition for _, condition in labels], dtype=str),
+                            'control': np.array([control for _, _, control, _ in walked], dtype=bool)}
+            self._groups = [rep_group for _, _, _, rep_group in walked]
+            self.refs = sorted(set(ref_name for rep_group in self._groups for ref_name in rep_group))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.h5.close()
+
+    def rows(self, sample_ids: list = None, target_cond: str = None, target: str = None, condition: str = None,
+             control: bool = None):
+        """
+        Returns the row indices of the samples matching all of the given selectors
+        """
+        mask = np.ones(len(self.samples['sample_id']), dtype=bool)
+        if sample_ids is not None:
+            mask &= np.isin(self.samples['sample_id'], [str(sample_id) for sample_id in sample_ids])
+        for key, value in (('target_cond', target_cond), ('target', target), ('condition', condition),
+                           ('control', control)):
+            if value is not None:
+                mask &= self.samples[key] == value
+        return np.flatnonzero(mask)
+
+    def get(self, ref_name: str, rows: np.ndarray = None, strand: str = None, **selectors):
+        """
+        ref_name: str
+            Reference name
+        rows: np.ndarray
+            Sample rows to read (defaults to the rows matching selectors, see rows)
+        strand: str
+            'forward' or 'reverse' to read a single strand
+        selectors:
+            Passed to rows if rows is None
+
+        Returns a (samples, 2, positions) array of composites, or (samples, positions) if strand is given. Samples
+        without the reference are zero-filled. Raises KeyError if no sample has the reference.
+        """
+        if ref_name not in self.refs:
+            raise KeyError('Reference {} not found'.format(ref_name))
+        if rows is None:
+            rows = self.rows(**selectors)
+        rows = np.asarray(rows, dtype=np.int64)
+        strand_idx = slice(None) if strand is None else ('forward', 'reverse').index(strand)
+
+        if self.consolidated:
+            data = self.h5['consolidated/refs'][ref_name]['data']
+            if len(rows) == 0:
+                return np.zeros((0, *data.shape[1:]), dtype=data.dtype)[:, strand_idx]
+            unique_rows, inverse = np.unique(rows, return_inverse=True)
+            if unique_rows[-1] - unique_rows[0] + 1 == len(unique_rows):
+                block = data[unique_rows[0]:unique_rows[-1] + 1, strand_idx]
+            else:
+                block = data[unique_rows, strand_idx]
+            return block[inverse]
+
+        # same shape as the consolidated layout, even if none of the selected samples have the reference
+        length = next(len(rep_group[ref_name]['forward']) for rep_group in self._groups if ref_name in rep_group)
+        data = np.zeros((len(rows), 2, length), dtype=np.int32)
+        for i, row in enumerate(rows):
+            ref_group = self._groups[row].get(ref_name)
+            if ref_group is not None:
+                data[i, 0] = ref_group['forward'][:]
+                data[i, 1] = ref_group['reverse'][:]
+        return data[:, strand_idx]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('h5_fn', help='pileup h5 file')
+    parser.add_argument('--out', '-o', default=None, help='output h5 file (defaults to adding to the input file)')
+    parser.add_argument('--chunk_samples', type=int, default=64, help='number of samples per HDF5 chunk')
+    args = parser.parse_args()
+
+    consolidate(args.h5_fn, out=args.out, chunk_samples=args.chunk_samples)
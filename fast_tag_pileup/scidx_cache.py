@@ -0,0 +1,281 @@
+import numpy as np
+import os
+import sys
+import json
+import shutil
+from filelock import SoftFileLock
+import argparse
+from multiprocessing import current_process
+
+_cache_version = 1
+
+def _bam_to_tags():
+    # imported lazily, so that pysam is only needed when reading BAM files
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bam_utils'))
+    import bam_to_tags
+    return bam_to_tags
+
+def is_bam(fn: str):
+    return fn.endswith('.bam')
+
+def read_chrom_sizes(chrom_sizes: str):
+    """
+    chrom_sizes: str
+        Path to the chrom.sizes file
+
+    Returns a dict mapping chromosome names to their sizes
+    """
+    sizes = {}
+    with open(chrom_sizes) as f:
+        for line in f:
+            chrom, size = line.strip().split()
+            sizes[chrom] = int(size)
+    return sizes
+
+def parse_scidx(scidx_fn: str, sizes: dict):
+    """
+    scidx_fn: str
+        Path to the scidx file
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+
+    Returns a dict mapping chromosome names to dense (size, 2) int32 arrays of forward and reverse tag counts. BAM
+    files are counted directly, see bam_utils/bam_to_tags.py.
+    """
+    if is_bam(scidx_fn):
+        return _bam_to_tags().bam_to_tags(scidx_fn, sizes, processes=1 if current_process().daemon else None)[0]
+    chrom_dict = {chrom: np.zeros((size, 2), dtype=np.int32) for chrom, size in sizes.items()}
+    with open(scidx_fn, 'r') as f:
+        f.readline()
+        f.readline()
+        for line in f:
+            line = line.strip().split('\t')
+            contig = line[0]
+            pos = int(line[1]) - 1
+            chrom_dict[contig][pos, 0] = int(line[2])
+            chrom_dict[contig][pos, 1] = int(line[3])
+    return chrom_dict
+
+def default_cache_dir(scidx_fn: str):
+    return '{}.cache'.format(scidx_fn)
+
+def _source_stat(scidx_fn: str):
+    st = os.stat(scidx_fn)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+def _read_manifest(cache_dir: str):
+    try:
+        with open(os.path.join(cache_dir, 'manifest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_stale(scidx_fn: str, sizes: dict, cache_dir: str = None):
+    """
+    scidx_fn: str
+        Path to the scidx file
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+    cache_dir: str
+        Path to the cache directory (defaults to <scidx_fn>.cache)
+
+    Returns True if the cache is missing or was built from a different scidx or chrom.sizes file
+    """
+    manifest = _read_manifest(cache_dir or default_cache_dir(scidx_fn))
+    return (manifest is None or manifest.get('version') != _cache_version
+            or manifest.get('source') != _source_stat(scidx_fn) or manifest.get('chrom_sizes') != sizes)
+
+def write_cache(chrom_dict: dict, cache_dir: str, source: dict = None, sparse: bool = None):
+    """
+    chrom_dict: dict
+        Dict mapping chromosome names to dense (size, 2) arrays of forward and reverse tag counts
+    cache_dir: str
+        Path to the cache directory, replaced if it already exists
+    source: dict
+        Size and mtime of the file the counts were generated from, used to detect stale caches
+    sparse: bool
+        If True, store only the nonzero positions and their counts; if None, pick whichever format is smaller
+    """
+    if sparse is None:
+        nnz = sum(int(np.count_nonzero(arr.any(axis=1))) for arr in chrom_dict.values())
+        total = sum(len(arr) for arr in chrom_dict.values())
+        # (pos, forward, reverse) costs 12 bytes per nonzero position vs 8 bytes per position dense
+        sparse = nnz * 12 < total * 8
+
+    tmp_dir = '{}.tmp'.format(cache_dir)
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+    for i, (chrom, arr) in enumerate(chrom_dict.items()):
+        arr = np.asarray(arr, dtype=np.int32)
+        if sparse:
+            pos = np.flatnonzero(arr.any(axis=1)).astype(np.int32)
+            np.save(os.path.join(tmp_dir, '{}.pos.npy'.format(i)), pos)
+            np.save(os.path.join(tmp_dir, '{}.counts.npy'.format(i)), arr[pos])
+        else:
+            np.save(os.path.join(tmp_dir, '{}.npy'.format(i)), arr)
+
+    manifest = {'version': _cache_version, 'source': source, 'format': 'sparse' if sparse else 'dense',
+                'chroms': list(chrom_dict), 'chrom_sizes': {chrom: len(arr) for chrom, arr in chrom_dict.items()}}
+    with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.rename(tmp_dir, cache_dir)
+
+def build_cache(scidx_fn: str, sizes: dict, cache_dir: str = None, sparse: bool = None):
+    """
+    scidx_fn: str
+        Path to the scidx file
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+    cache_dir: str
+        Path to the cache directory (defaults to <scidx_fn>.cache)
+    sparse: bool
+        If True, store only the nonzero positions and their counts; if None, pick whichever format is smaller
+    """
+    cache_dir = cache_dir or default_cache_dir(scidx_fn)
+    if is_bam(scidx_fn):
+        _bam_to_tags().build_bam_cache(scidx_fn, sizes, cache_dir=cache_dir, sparse=sparse,
+                                       processes=1 if current_process().daemon else None)
+        return
+    source = _source_stat(scidx_fn)
+    write_cache(parse_scidx(scidx_fn, sizes), cache_dir, source=source, sparse=sparse)
+
+class SparseCounts:
+    """
+    Read-only (size, 2) tag counts of one chromosome of a sparse cache, gathered from the memory-mapped nonzero
+    positions and their counts without expanding them into a dense array
+
+    pos: np.ndarray
+        Sorted nonzero positions
+    counts: np.ndarray
+        (len(pos), 2) forward and reverse counts at pos
+    size: int
+        Size of the chromosome
+    """
+
+    def __init__(self, pos: np.ndarray, counts: np.ndarray, size: int):
+        self.pos = pos
+        self.counts = counts
+        self.shape = (size, 2)
+        self.dtype = counts.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        """
+        counts[positions, strand], where positions is an integer array of any shape (the gather done by
+        bulk_pileup.iter_site_counts)
+        """
+        positions, strand = key
+        positions = np.asarray(positions)
+        if len(self.pos) == 0:
+            return np.zeros(positions.shape + np.empty(2)[strand].shape, dtype=self.dtype)
+        if positions.ndim == 2 and positions.shape[1] > 1:
+            step = positions[:, 1] - positions[:, 0]
+            if np.all(np.abs(step) == 1) and np.all(np.diff(positions, axis=1) == step[:, None]):
+                return self._gather_windows(positions, step, strand)
+        # search with the dtype of pos so that the memory-mapped array is not converted
+        k = np.minimum(np.searchsorted(self.pos, positions.astype(self.pos.dtype)), len(self.pos) - 1)
+        values = self.counts[k, strand]
+        hit = self.pos[k] == positions
+        return np.where(hit if values.ndim == hit.ndim else hit[..., None], values, 0)
+
+    def _gather_windows(self, positions: np.ndarray, step: np.ndarray, strand):
+        # rows of consecutive positions (ascending or descending): search only the ends of each row and scatter the
+        # nonzero positions in between
+        first, last = positions[:, 0], positions[:, -1]
+        k_lo = np.searchsorted(self.pos, np.minimum(first, last).astype(self.pos.dtype))
+        k_hi = np.searchsorted(self.pos, np.maximum(first, last).astype(self.pos.dtype), side='right')
+        n = k_hi - k_lo
+        rows = np.repeat(np.arange(len(positions)), n)
+        k = np.arange(n.sum()) + np.repeat(k_lo - (np.cumsum(n) - n), n)
+        cols = (self.pos[k] - first[rows]) * step[rows]
+        out = np.zeros(positions.shape + np.empty(2)[strand].shape, dtype=self.dtype)
+        out[rows, cols] = self.counts[k, strand]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        arr = np.zeros(self.shape, dtype=self.dtype)
+        arr[self.pos] = self.counts
+        return arr if dtype is None else arr.astype(dtype)
+
+def _load(fn: str):
+    # numpy cannot memory-map an empty array
+    try:
+        return np.load(fn, mmap_mode='r')
+    except ValueError:
+        return np.load(fn)
+
+def cache_size(cache_dir: str):
+    """
+    Size in bytes of the count arrays of a cache (0 if there is no cache)
+    """
+    manifest = _read_manifest(cache_dir)
+    if manifest is None:
+        return 0
+    suffixes = ('pos.npy', 'counts.npy') if manifest['format'] == 'sparse' else ('npy',)
+    return sum(os.path.getsize(os.path.join(cache_dir, '{}.{}'.format(i, suffix)))
+               for i in range(len(manifest['chroms'])) for suffix in suffixes)
+
+def read_cache(cache_dir: str):
+    """
+    cache_dir: str
+        Path to the cache directory
+
+    Returns a dict mapping chromosome names to (size, 2) int32 arrays of forward and reverse tag counts. Dense caches
+    are memory-mapped read-only; sparse caches are memory-mapped as SparseCounts, which support the gathers of
+    bulk_pileup.pileup_ref (np.asarray expands them into dense arrays).
+    """
+    manifest = _read_manifest(cache_dir)
+    if manifest is None:
+        raise FileNotFoundError('No scidx cache found at {}'.format(cache_dir))
+    chrom_dict = {}
+    for i, chrom in enumerate(manifest['chroms']):
+        if manifest['format'] == 'sparse':
+            chrom_dict[chrom] = SparseCounts(_load(os.path.join(cache_dir, '{}.pos.npy'.format(i))),
+                                             _load(os.path.join(cache_dir, '{}.counts.npy'.format(i))),
+                                             manifest['chrom_sizes'][chrom])
+        else:
+            chrom_dict[chrom] = np.load(os.path.join(cache_dir, '{}.npy'.format(i)), mmap_mode='r')
+    return chrom_dict
+
+def load_scidx(scidx_fn: str, sizes: dict, cache_dir: str = None, sparse: bool = None):
+    """
+    scidx_fn: str
+        Path to the scidx file
+    sizes: dict
+        Dict mapping chromosome names to their sizes
+    cache_dir: str
+        Path to the cache directory (defaults to <scidx_fn>.cache)
+    sparse: bool
+        Format used if the cache has to be (re)built, see write_cache
+
+    Returns the tag counts of the scidx file from its binary cache, building the cache first if it is missing or
+    out of date
+    """
+    cache_dir = cache_dir or default_cache_dir(scidx_fn)
+    if is_stale(scidx_fn, sizes, cache_dir):
+        with SoftFileLock('{}.lock'.format(cache_dir)):
+            if is_stale(scidx_fn, sizes, cache_dir):
+                build_cache(scidx_fn, sizes, cache_dir=cache_dir, sparse=sparse)
+    return read_cache(cache_dir)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('scidx_fns', nargs='+', help='scidx files')
+    parser.add_argument('--chrom_sizes', '-cs', required=True, help='chrom.sizes file')
+    parser.add_argument('--sparse', action='store_true', default=None, help='force the sparse cache format')
+    parser.add_argument('--dense', action='store_false', dest='sparse', help='force the dense cache format')
+    parser.add_argument('--force', '-f', action='store_true', help='rebuild caches even if they are up to date')
+    args = parser.parse_args()
+
+    sizes = read_chrom_sizes(args.chrom_sizes)
+    for scidx_fn in args.scidx_fns:
+        print(scidx_fn)
+        if args.force or is_stale(scidx_fn, sizes):
+            with SoftFileLock('{}.lock'.format(default_cache_dir(scidx_fn))):
+                build_cache(scidx_fn, sizes, sparse=args.sparse)
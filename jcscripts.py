@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import subprocess
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+# subcommand -> (directory, module, description). Modules are only imported when their subcommand runs, so the heavy
+# dependencies of one tool (h5py, pandas, pysam, ...) are never loaded by another.
+commands = {
+    'pileup': ('fast_tag_pileup', 'bulk_pileup', 'pile up the tags of one scidx or BAM file into an h5 file'),
+    'batch': ('fast_tag_pileup', 'batch_pileup', 'pile up many scidx or BAM files into an h5 file in parallel'),
+    'bam': ('bam_utils', 'bam_to_tags', 'count 5\' tags of BAM files into scidx caches'),
+    'norm': ('chip_exo_normalization', 'histone_norm', 'normalize CDTs by the row sums of a scaling CDT'),
+    'sort': ('chip_exo_sort', 'cdt_sort', 'sort CDT rows by proximal/distal window sums'),
+    'logos': ('motif_utils', 'generate_motif_logos', 'draw SVG logos of the motifs in a MEME file'),
+    'meme': ('motif_utils', 'meme_output_parser', 'summarize the motifs and sites of MEME files'),
+    'pegr': ('pegr_utils', 'pegr_client', 'fetch PEGR sample metadata'),
+}
+
+
+def load(command):
+    """
+    Import and return the module of a subcommand
+    """
+    directory, module, _ = commands[command]
+    path = os.path.join(root, directory)
+    if path not in sys.path:
+        sys.path.append(path)
+    return importlib.import_module(module)
+
+
+def run(command, argv=None):
+    load(command).main(argv, prog='jcscripts {}'.format(command))
+
+
+def import_times(command, python=sys.executable):
+    """
+    Import the module of a subcommand in a fresh interpreter with -X importtime
+    Args:
+        command: Subcommand
+        python: Python executable
+
+    Returns:
+        Total import time in seconds and a dict mapping top-level packages to the time spent importing their own
+        modules (excluding the modules they import from other packages)
+    """
+    directory, module, _ = commands[command]
+    code = 'import sys; sys.path.append({!r}); import {}'.format(os.path.join(root, directory), module)
+    result = subprocess.run([python, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError('Importing {} failed:\n{}'.format(module, result.stderr))
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return sum(packages.values()), packages
+
+
+def startup_time(argv, repeat=5, python=sys.executable):
+    """
+    Best wall time of repeat runs of a command in a fresh interpreter
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([python, *argv], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(names=None, repeat=5, top=5):
+    """
+    Startup cost of each subcommand: the wall time of `jcscripts <command> --help` (which imports the command's
+    module) next to bare interpreter startup, and the import time of its heaviest packages
+    Args:
+        names: Subcommands to benchmark (defaults to all)
+        repeat: Number of runs to take the best wall time of
+        top: Number of packages to report per subcommand
+
+    Returns:
+        Dict with the interpreter startup time and a report per subcommand
+    """
+    report = {'python': startup_time(['-c', 'pass'], repeat),
+              'jcscripts': startup_time([os.path.abspath(__file__), '--help'], repeat), 'commands': {}}
+    for command in names or commands:
+        total, packages = import_times(command)
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+        report['commands'][command] = {'help': startup_time([os.path.abspath(__file__), command, '--help'], repeat),
+                                       'imports': total, 'packages': dict(heaviest)}
+    return report
+
+
+def print_benchmark(report):
+    print('python startup {:.3f}s, jcscripts --help {:.3f}s'.format(report['python'], report['jcscripts']))
+    for command, result in report['commands'].items():
+        packages = ', '.join('{} {:.3f}s'.format(package, t) for package, t in result['packages'].items())
+        print('{:<8} --help {:.3f}s  imports {:.3f}s  ({})'.format(command, result['help'], result['imports'],
+                                                                     packages))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='jcscripts', formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='commands:\n' + '\n'.join('  {:<10}{}'.format(command, description)
+                                              for command, (_, _, description) in commands.items())
+        + '\n  {:<10}{}'.format('imports', 'report the startup and import time of each command'),
+        epilog='run jcscripts <command> --help for the options of a command')
+    parser.add_argument('command', choices=[*commands, 'imports'], metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='arguments of the command')
+    args = parser.parse_args(argv)
+
+    if args.command != 'imports':
+        return run(args.command, args.args)
+
+    parser = argparse.ArgumentParser(prog='jcscripts imports')
+    parser.add_argument('commands', nargs='*', help='commands to benchmark (default all)')
+    parser.add_argument('--repeat', '-n', type=int, default=5, help='runs per measurement (the best is reported)')
+    parser.add_argument('--top', '-t', type=int, default=5, help='number of packages reported per command')
+    parser.add_argument('--out', '-o', default=None, help='also write the report as JSON')
+    args = parser.parse_args(args.args)
+    unknown = [command for command in args.commands if command not in commands]
+    if unknown:
+        parser.error('unknown commands: {}'.format(', '.join(unknown)))
+
+    report = benchmark(args.commands, repeat=args.repeat, top=args.top)
+    print_benchmark(report)
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import numpy as np
+import scipy
+import scipy.special
+import argparse
+import itertools
+import json
+import math
+import platform
+import time
+import tracemalloc
+import warnings
+from logbetainc import logbetainc, logbetah, logbetainc_lentz, logbetah_lentz, LogBetahTable
+from interp_inverse import invert, invertnd
+from get_log_stirling_numbers import get_log_stirling_numbers
+from bron_kerbosch import get_maximal_cliques
+
+
+def measure(fn, repeat=3):
+    """
+    Time a function and record its peak memory
+    Args:
+        fn: Function with no arguments
+        repeat: Number of timed calls (the fastest is reported)
+
+    Returns:
+        Dict with the best wall time in seconds, the peak traced memory in bytes, and the result of the last call
+    """
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak, 'result': result}
+
+
+def _errors(values, reference):
+    """
+    Maximum and median relative errors of values against a reference (absolute errors where the reference is smaller
+    than 1 in magnitude, since log probabilities near 0 have no useful relative error), ignoring entries where the
+    reference is not finite
+    """
+    values = np.asarray(values, dtype=np.float64)
+    reference = np.asarray(reference, dtype=np.float64)
+    finite = np.isfinite(reference)
+    if not finite.any():
+        return {'max_rel_error': None, 'median_rel_error': None, 'n_nonfinite': int(values.size)}
+    rel = np.abs(values[finite] - reference[finite]) / np.maximum(np.abs(reference[finite]), 1.)
+    rel[np.isnan(rel)] = np.inf
+    return {'max_rel_error': float(rel.max()), 'median_rel_error': float(np.median(rel)),
+            'n_nonfinite': int(np.sum(~np.isfinite(values[finite])))}
+
+
+def _record(name, size, timing, accuracy=None):
+    record = {'function': name, 'size': size, 'seconds': timing['seconds'], 'peak_bytes': timing['peak_bytes']}
+    if accuracy is not None:
+        record.update(accuracy)
+    return record
+
+
+def bench_logbetainc(sizes, repeat=3, seed=0):
+    """
+    Benchmark logbetainc, logbetah, and their adaptive and table-based variants against scipy.special.betainc
+    """
+    rng = np.random.default_rng(seed)
+    records = []
+    a, b, x = 3.5, 40.2, .2
+    reference = np.log(scipy.special.betainc(a, b, x))
+    for name, fn in (('logbetainc', lambda: logbetainc(a, b, x)),
+                     ('logbetainc_lentz', lambda: logbetainc_lentz(a, b, x))):
+        timing = measure(fn, repeat)
+        records.append(_record(name, 'scalar', timing, _errors(timing['result'], reference)))
+
+    for size in sizes:
+        a = np.exp(rng.uniform(-1, 6, size))
+        b = np.exp(rng.uniform(-1, 6, size))
+        x = rng.uniform(0, 1, size)
+        with np.errstate(divide='ignore'):
+            reference = np.log(scipy.special.betainc(a, b, x))
+        reference[reference < -600] = np.nan  # betainc underflows to 0 long before the log does
+        for name, fn in (('logbetainc', lambda: logbetainc(a, b, x)),
+                         ('logbetainc_lentz', lambda: logbetainc_lentz(a, b, x))):
+            timing = measure(fn, repeat)
+            records.append(_record(name, size, timing, _errors(timing['result'], reference)))
+
+        counts_a = rng.integers(1, 200, size)
+        counts_b = rng.integers(1, 200, size)
+        reference = np.log(scipy.special.betainc(counts_a, counts_b, .5))
+        float_a, float_b = counts_a.astype(np.float64), counts_b.astype(np.float64)
+        table = LogBetahTable()
+        table(counts_a, counts_b)  # time warm lookups, the table is filled once per process
+        for name, fn in (('logbetah', lambda: logbetah(float_a, float_b)),
+                         ('logbetah_lentz', lambda: logbetah_lentz(float_a, float_b)),
+                         ('LogBetahTable', lambda: table(counts_a, counts_b))):
+            timing = measure(fn, repeat)
+            records.append(_record(name, size, timing, _errors(timing['result'], reference)))
+    return records
+
+
+def bench_invert(sizes, repeat=3, seed=0):
+    """
+    Benchmark invert and invertnd against analytic inverses
+    """
+    rng = np.random.default_rng(seed)
+    records = []
+    for size in sizes:
+        domain = np.linspace(0, 4, max(size, 2))
+        query = rng.uniform(1, np.exp(4), size)
+        timing = measure(lambda: invert(np.exp, domain, vectorized=True), repeat)
+        records.append(_record('invert.build', size, timing))
+        f_inverse = timing['result']
+        timing = measure(lambda: f_inverse(query), repeat)
+        records.append(_record('invert.eval', size, timing, _errors(timing['result'], np.log(query))))
+
+        # keep the griddata triangulation tractable, it grows with the product of the grid sizes
+        n = max(4, int(np.sqrt(size)))
+        if n > 200:
+            continue
+        x = np.linspace(0, 2, n)
+        v = np.linspace(0, 1, n)
+        y_query = rng.uniform(1, 8, size)
+        v_query = rng.uniform(0, 1, size)
+        timing = measure(lambda: invertnd(lambda x_, v_: x_ ** 3 + v_, x, v, vectorized=True), repeat)
+        records.append(_record('invertnd.build', n * n, timing))
+        f_inverse = timing['result']
+        timing = measure(lambda: f_inverse(y_query, v_query), repeat)
+        records.append(_record('invertnd.eval', size, timing, _errors(timing['result'], np.cbrt(y_query - v_query))))
+    return records
+
+
+def exact_log_stirling_numbers(N):
+    """
+    Log of the unsigned Stirling numbers of the first kind for n = N computed exactly with Python integers
+    """
+    curr = [1]
+    for n in range(N):
+        curr = [(n * curr[k] if k < len(curr) else 0) + (curr[k - 1] if k > 0 else 0) for k in range(len(curr) + 1)]
+    return np.array([math.log(c) if c > 0 else -np.inf for c in curr])
+
+
+def bench_stirling(sizes, repeat=3):
+    """
+    Benchmark get_log_stirling_numbers against exact integer Stirling numbers
+    """
+    records = []
+    for size in sizes:
+        timing = measure(lambda: get_log_stirling_numbers(size), repeat)
+        reference = exact_log_stirling_numbers(size) if size <= 2000 else None
+        accuracy = None if reference is None else _errors(timing['result'], reference)
+        records.append(_record('get_log_stirling_numbers', size, timing, accuracy))
+    return records
+
+
+def random_graph(n, p, seed=0):
+    """
+    Erdos-Renyi graph as a dict mapping nodes to sets of neighbors
+    """
+    rng = np.random.default_rng(seed)
+    neighbors = {i: set() for i in range(n)}
+    for i, j in zip(*np.nonzero(np.triu(rng.random((n, n)) < p, k=1))):
+        neighbors[int(i)].add(int(j))
+        neighbors[int(j)].add(int(i))
+    return neighbors
+
+
+def brute_force_cliques(neighbors):
+    """
+    All maximal cliques by checking every subset of nodes (only feasible for small graphs)
+    """
+    nodes = sorted(neighbors)
+    cliques = [frozenset(subset) for r in range(1, len(nodes) + 1) for subset in itertools.combinations(nodes, r)
+               if all(v in neighbors[u] for u, v in itertools.combinations(subset, 2))]
+    return {c for c in cliques if not any(c < other for other in cliques if len(other) == len(c) + 1)}
+
+
+def bench_cliques(sizes, repeat=3, p=.3, seed=0):
+    """
+    Benchmark get_maximal_cliques on random graphs, checked against brute force for small graphs
+    """
+    records = []
+    for size in sizes:
+        neighbors = random_graph(size, p, seed=seed)
+        timing = measure(lambda: set(get_maximal_cliques(neighbors)), repeat)
+        accuracy = {'n_cliques': len(timing['result'])}
+        if size <= 16:
+            accuracy['matches_reference'] = timing['result'] == brute_force_cliques(neighbors)
+        records.append(_record('get_maximal_cliques', size, timing, accuracy))
+    return records
+
+
+def run_benchmarks(sizes=(1, 100, 10000, 1000000), stirling_sizes=(10, 100, 1000), clique_sizes=(12, 16, 100, 400),
+                   repeat=3, only=None, seed=0):
+    """
+    Run all the math benchmarks
+    Args:
+        sizes: Array sizes for logbetainc, logbetah, and invert
+        stirling_sizes: Values of n for get_log_stirling_numbers
+        clique_sizes: Numbers of nodes for get_maximal_cliques
+        repeat: Number of timed calls per measurement
+        only: Benchmark groups to run ('logbetainc', 'invert', 'stirling', 'cliques'), all if None
+        seed: Random seed for the inputs
+
+    Returns:
+        Dict with environment metadata and a list of benchmark records
+    """
+    groups = {'logbetainc': lambda: bench_logbetainc(sizes, repeat, seed),
+              'invert': lambda: bench_invert(sizes, repeat, seed),
+              'stirling': lambda: bench_stirling(stirling_sizes, repeat),
+              'cliques': lambda: bench_cliques(clique_sizes, repeat, seed=seed)}
+    records = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for group, bench in groups.items():
+            if only is None or group in only:
+                records.extend(bench())
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'machine': platform.machine(), 'repeat': repeat,
+            'results': records}
+
+
+def compare(old, new, threshold=1.2):
+    """
+    Compare two benchmark results
+    Args:
+        old: Baseline benchmark dict (see run_benchmarks)
+        new: New benchmark dict
+        threshold: Ratio of new to old time above which a result is flagged as a regression
+
+    Returns:
+        List of (function, size, old seconds, new seconds, ratio, regression) tuples for results in both
+    """
+    baseline = {(r['function'], str(r['size'])): r for r in old['results']}
+    rows = []
+    for r in new['results']:
+        key = (r['function'], str(r['size']))
+        if key in baseline:
+            ratio = r['seconds'] / max(baseline[key]['seconds'], 1e-12)
+            rows.append((*key, baseline[key]['seconds'], r['seconds'], ratio, ratio > threshold))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', '-o', default='benchmark.json', help='output JSON file')
+    parser.add_argument('--sizes', '-s', type=int, nargs='+', default=[1, 100, 10000, 1000000],
+                        help='array sizes for logbetainc, logbetah, and invert')
+    parser.add_argument('--stirling_sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--clique_sizes', type=int, nargs='+', default=[12, 16, 100, 400])
+    parser.add_argument('--repeat', '-r', type=int, default=3, help='number of timed calls per measurement')
+    parser.add_argument('--only', nargs='+', default=None, choices=['logbetainc', 'invert', 'stirling', 'cliques'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', '-c', default=None, help='baseline JSON file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2, help='slowdown ratio flagged as a regression')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.stirling_sizes, args.clique_sizes, repeat=args.repeat, only=args.only,
+                             seed=args.seed)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    for r in results['results']:
+        print('{function}\t{size}\t{seconds:.6f}s\t{peak_bytes}B'.format(**r))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        for function, size, old_s, new_s, ratio, regression in compare(old, results, args.threshold):
+            print('{}\t{}\t{:.6f}s -> {:.6f}s\t{:.2f}x{}'.format(function, size, old_s, new_s, ratio,
+                                                                 '\tREGRESSION' if regression else ''))
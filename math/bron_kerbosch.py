@@ -1,13 +1,25 @@
-def get_maximal_cliques(neighbors: dict):
+import heapq
+from multiprocessing import Pool
+
+
+def get_maximal_cliques(neighbors: dict, engine: str = 'sets', processes: int = 1, chunksize: int = 16):
     """
     Get all maximal cliques in an undirected graph
     Args:
         neighbors: dict mapping nodes to sets of neighbors
+        engine: 'sets' for recursive Bron-Kerbosch over sets, or 'bitset' for iterative Bron-Kerbosch over integer
+            bitsets with a degeneracy ordering at the outer level
+        processes: Number of processes the outer-level branches are distributed across ('bitset' only)
+        chunksize: Number of outer-level branches sent to a process at a time ('bitset' only)
 
     Returns:
         Generator of frozensets for all maximal cliques
     """
-    return _BK(set(neighbors), neighbors)
+    if engine == 'sets':
+        return _BK(set(neighbors), neighbors)
+    if engine == 'bitset':
+        return _bitset_cliques(neighbors, processes, chunksize)
+    raise ValueError('Unknown engine: {}'.format(engine))
 
 
 def _BK(P, neighbors, R=frozenset(), X=frozenset()):
@@ -19,3 +31,100 @@ def _BK(P, neighbors, R=frozenset(), X=frozenset()):
             yield from _BK(P & neighbors[v], neighbors, R=R | {v}, X=X & neighbors[v])
             P = P - {v}
             X = X | {v}
+
+
+def degeneracy_order(neighbors: dict):
+    """
+    Order nodes by repeatedly removing a node of minimum degree in the remaining graph
+    Args:
+        neighbors: dict mapping nodes to sets of neighbors
+
+    Returns:
+        List of nodes in degeneracy order
+    """
+    degree = {node: len(neighbors[node] - {node}) for node in neighbors}
+    heap = [(d, i, node) for i, (node, d) in enumerate(degree.items())]
+    heapq.heapify(heap)
+    index = {node: i for i, node in enumerate(neighbors)}
+    removed = set()
+    order = []
+    while heap:
+        d, _, node = heapq.heappop(heap)
+        if node in removed or d != degree[node]:
+            continue
+        removed.add(node)
+        order.append(node)
+        for other in neighbors[node]:
+            if other not in removed and other != node:
+                degree[other] -= 1
+                heapq.heappush(heap, (degree[other], index[other], other))
+    return order
+
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def _bitset_branch(adj, v):
+    """
+    Maximal cliques containing v whose other members all come later in the (degeneracy) numbering, found with an
+    explicit stack instead of recursion
+    """
+    later = adj[v] >> (v + 1) << (v + 1)
+    stack = [((v,), later, adj[v] ^ later)]
+    while stack:
+        R, P, X = stack.pop()
+        if not P:
+            if not X:
+                yield R
+            continue
+        # pivot on the node of P | X with the most neighbors in P, stopping early if one covers all of P
+        n_p = P.bit_count()
+        best, best_count = -1, -1
+        mask = P | X
+        while mask:
+            low = mask & -mask
+            mask ^= low
+            p = low.bit_length() - 1
+            count = (P & adj[p]).bit_count()
+            if count > best_count:
+                best, best_count = p, count
+                if count >= n_p - 1:
+                    break
+        for w in _bits(P & ~adj[best]):
+            stack.append((R + (w,), P & adj[w], X & adj[w]))
+            P &= ~(1 << w)
+            X |= 1 << w
+
+
+_worker_adj = None
+
+
+def _init_worker(adj):
+    global _worker_adj
+    _worker_adj = adj
+
+
+def _branch_worker(vs):
+    return [clique for v in vs for clique in _bitset_branch(_worker_adj, v)]
+
+
+def _bitset_cliques(neighbors, processes=1, chunksize=16):
+    order = degeneracy_order(neighbors)
+    label = {node: i for i, node in enumerate(order)}
+    adj = [sum(1 << label[other] for other in neighbors[node] if other != node) for node in order]
+
+    if processes <= 1:
+        for v in range(len(order)):
+            for clique in _bitset_branch(adj, v):
+                yield frozenset(order[i] for i in clique)
+        return
+
+    chunks = [range(i, min(i + chunksize, len(order))) for i in range(0, len(order), chunksize)]
+    with Pool(processes, initializer=_init_worker, initargs=(adj,)) as pool:
+        for cliques in pool.imap_unordered(_branch_worker, chunks):
+            for clique in cliques:
+                yield frozenset(order[i] for i in clique)
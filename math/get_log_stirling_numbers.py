@@ -1,4 +1,95 @@
 import numpy as np
+import os
+
+
+def _offset(n):
+    return n * (n + 1) // 2
+
+
+class LogStirlingTable:
+    """
+    Triangular table of the log of the unsigned Stirling numbers of the first kind, stored row after row in one flat
+    buffer (row n holds k = 0..n at offset n (n + 1) / 2) and extended in place as larger n are requested. The table
+    holds about 4 N^2 bytes, so create one only where many rows are looked up (get_log_stirling_numbers keeps no table).
+    Args:
+        path: Optional .npy file to memory-map the buffer to, so the table is kept across processes
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.n_rows = 0
+        self.capacity = 0
+        self.buffer = np.empty(0)
+        if path is not None and os.path.exists(path):
+            self.buffer = np.load(path, mmap_mode='r+')
+            self.capacity = int((np.sqrt(8 * len(self.buffer) + 1) - 1) / 2)
+            # rows are filled in order and the last entry of every filled row is log(1) = 0
+            diag = self.buffer[_offset(np.arange(self.capacity)) + np.arange(self.capacity)]
+            self.n_rows = int(np.argmin(diag == 0)) if not np.all(diag == 0) else self.capacity
+        self.reserve(1)
+
+    def reserve(self, N):
+        """
+        Make sure the rows for all n <= N are computed
+        """
+        if N < self.n_rows:
+            return
+        if N >= self.capacity:
+            self._grow(max(N + 1, self.capacity + self.capacity // 2))
+
+        buffer = self.buffer
+        if self.n_rows == 0:
+            buffer[0] = 0
+            self.n_rows = 1
+        for n in range(self.n_rows - 1, N):
+            curr = buffer[_offset(n):_offset(n + 1)]
+            new = buffer[_offset(n + 1):_offset(n + 2)]
+            # n * [n k] + [n k-1]
+            if n > 0:
+                np.logaddexp(np.log(n) + curr[1:], curr[:-1], out=new[1:-1])
+            new[0] = -np.inf
+            new[-1] = 0
+        self.n_rows = N + 1
+        if isinstance(buffer, np.memmap):
+            buffer.flush()
+
+    def _grow(self, capacity):
+        size = _offset(capacity)
+        if self.path is None:
+            buffer = np.empty(size)
+        else:
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            buffer = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64, shape=(size,))
+        computed = _offset(self.n_rows)
+        buffer[:computed] = self.buffer[:computed]
+        buffer[computed:] = np.nan
+        if self.path is not None:
+            buffer.flush()
+            del buffer
+            self.buffer = None
+            os.replace(tmp, self.path)
+            buffer = np.load(self.path, mmap_mode='r+')
+        self.buffer = buffer
+        self.capacity = capacity
+
+    def row(self, N):
+        """
+        Log Stirling numbers for all k given n = N (a view into the table)
+        """
+        self.reserve(N)
+        return self.buffer[_offset(N):_offset(N + 1)]
+
+    def __call__(self, n, k):
+        """
+        Log Stirling numbers for arrays of n and k (broadcast together), -inf where k > n or k < 0
+        """
+        n, k = np.broadcast_arrays(np.asarray(n, dtype=np.int64), np.asarray(k, dtype=np.int64))
+        if n.size:
+            self.reserve(int(n.max()))
+        valid = (k >= 0) & (k <= n)
+        ans = np.full(n.shape, -np.inf)
+        ans[valid] = self.buffer[_offset(n[valid]) + k[valid]]
+        return ans[()]
 
 
 def get_log_stirling_numbers(N):
@@ -11,8 +102,15 @@ def get_log_stirling_numbers(N):
     Returns:
         Array of log Stirling numbers for all k given n
     """
-    curr = np.zeros(1)
+    # roll between two rows preallocated to the final length, so only O(N) memory is used
+    curr = np.empty(N + 1)
+    new = np.empty(N + 1)
+    curr[0] = 0
     for n in range(N):
-        curr = np.logaddexp(np.log(n) + curr[1:], curr[:-1])  # n * [n k] + [n k-1]
-        curr = np.insert(curr, [0, n], [-np.inf, 0])  # put 0 at the beginning and 1 at the end
+        if n > 0:
+            np.add(curr[1:n + 1], np.log(n), out=new[1:n + 1])
+            np.logaddexp(new[1:n + 1], curr[:n], out=new[1:n + 1])  # n * [n k] + [n k-1]
+        new[0] = -np.inf
+        new[n + 1] = 0
+        curr, new = new, curr
     return curr
@@ -1,5 +1,10 @@
 import numpy as np
 import scipy.interpolate
+import scipy.spatial
+import hashlib
+import os
+import pickle
+import warnings
 
 
 def invert(f, x, kind='linear', vectorized=False):
@@ -45,7 +50,66 @@ def invert(f, x, kind='linear', vectorized=False):
     return f_inverse
 
 
-def invertnd(f, x, *other_vars, kind='linear', vectorized=False):
+def _sha1(*arrays):
+    h = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(str((arr.dtype, arr.shape)).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def _triangulate(points, cache=None):
+    """
+    Delaunay triangulation of points, loaded from (and saved to) a pickle file if cache is given
+    """
+    key = _sha1(points)
+    if cache is not None and os.path.exists(cache):
+        with open(cache, 'rb') as f:
+            cached = pickle.load(f)
+        if cached.get('key') == key:
+            return cached['tri']
+
+    tri = scipy.spatial.Delaunay(points)
+    if cache is not None:
+        tri.transform  # computed lazily on the first lookup, pickled with the triangulation once computed
+        tmp = '{}.{}.tmp'.format(cache, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump({'key': key, 'tri': tri}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, cache)
+    return tri
+
+
+def _grid_inverse(y, x, other_vars):
+    """
+    Inverse of a function sampled on a regular grid that is strictly monotone in the same direction along the first axis
+    for every value of the other variables. The sampled columns are linearly interpolated to the requested parameters
+    (which keeps them monotone), then inverted by linear interpolation along the first axis.
+    """
+    if np.all(np.diff(y, axis=0) < 0):
+        y, sign = -y, -1
+    else:
+        sign = 1
+    columns = scipy.interpolate.RegularGridInterpolator(other_vars, np.moveaxis(y, 0, -1), method='linear',
+                                                        bounds_error=False, fill_value=np.nan)
+
+    def f_inverse(x_new, *v_new):
+        x_new, *v_new = np.broadcast_arrays(np.asarray(x_new, dtype=float) * sign, *v_new)
+        shape = x_new.shape
+        y_cols = columns(np.stack([v.ravel() for v in v_new], axis=-1))
+        x_new = x_new.ravel()
+        k = np.clip(np.sum(y_cols < x_new[:, None], axis=1), 1, len(x) - 1)
+        rows = np.arange(len(x_new))
+        y_lo = y_cols[rows, k - 1]
+        y_hi = y_cols[rows, k]
+        ans = x[k - 1] + (x[k] - x[k - 1]) * (x_new - y_lo) / (y_hi - y_lo)
+        ans[(x_new < y_cols[:, 0]) | (x_new > y_cols[:, -1]) | np.isnan(x_new)] = np.nan
+        return ans.reshape(shape)
+
+    return f_inverse
+
+
+def invertnd(f, x, *other_vars, kind='linear', vectorized=False, regular_grid=True, cache=None):
     """
     Invert a multivariate function numerically
     Args:
@@ -55,9 +119,14 @@ def invertnd(f, x, *other_vars, kind='linear', vectorized=False):
         kind: Specifies the kind of interpolation as a string ('linear', 'nearest', 'cubic')
             (cubic only available for 1 or 2 variables)
         vectorized: Specifies if the input function is vectorized
+        regular_grid: If kind is 'linear', x and other_vars are strictly increasing, and the function is strictly
+            monotone in the same direction along x for every value of other_vars, interpolate on the regular input
+            grid instead of triangulating the scattered samples
+        cache: Path to a pickle file in which to save the Delaunay triangulation (reused if the sampled points match)
 
     Returns:
-        Inverted function where the first argument corresponds to the output of the original function
+        Inverted function where the first argument corresponds to the output of the original function, with the
+        underlying interpolator as its interpolator attribute
     """
     n = len(x)
 
@@ -98,10 +167,203 @@ def invertnd(f, x, *other_vars, kind='linear', vectorized=False):
     if not np.issubdtype(y.dtype, np.number):
         raise ValueError('Input function is not numeric')
 
-    points = np.array(list(zip(y.flat, *(v.flat for v in v_arrs))))
-    values = np.array(x_arr.flat)
+    if not other_vars:
+        y = y.ravel()
+        order = np.argsort(y)
+        interpolator = scipy.interpolate.interp1d(y[order], x_arr.ravel()[order], kind=kind, bounds_error=False,
+                                                  fill_value=np.nan)
+
+        def f_inverse(x_new):
+            return interpolator(x_new)
+
+        f_inverse.interpolator = interpolator
+        return f_inverse
+
+    if regular_grid and kind == 'linear' and n > 1 and all(np.all(np.diff(v) > 0) for v in (x, *other_vars)):
+        diffs = np.diff(y, axis=0)
+        if np.all(diffs > 0) or np.all(diffs < 0):
+            f_inverse = _grid_inverse(np.asarray(y, dtype=float), np.asarray(x, dtype=float),
+                                      [np.asarray(v, dtype=float) for v in other_vars])
+            f_inverse.interpolator = None
+            return f_inverse
+
+    points = np.column_stack([y.ravel(), *(v.ravel() for v in v_arrs)])
+    values = x_arr.ravel()
+    if kind == 'nearest':
+        interpolator = scipy.interpolate.NearestNDInterpolator(points, values)
+    elif kind == 'linear':
+        interpolator = scipy.interpolate.LinearNDInterpolator(_triangulate(points, cache), values)
+    elif kind == 'cubic' and points.shape[1] == 2:
+        interpolator = scipy.interpolate.CloughTocher2DInterpolator(_triangulate(points, cache), values)
+    else:
+        raise ValueError('Unknown interpolation method {} for dimension {}'.format(kind, points.shape[1]))
 
     def f_inverse(x_new, *v_new):
-        return scipy.interpolate.griddata(points, values, (x_new, *v_new), method=kind)
+        return interpolator(x_new, *v_new)
 
+    f_inverse.interpolator = interpolator
     return f_inverse
+
+
+class MonotoneInverse:
+    """
+    Inverse of a strictly monotone function on [lo, hi] that can be evaluated repeatedly on arrays of targets
+
+    Attributes:
+        x_min, x_max: Bounds of the range of the original function (the domain of the inverse)
+        x, y: Sampled points of the function, sorted by x
+        n_evals: Number of points at which the function has been evaluated
+        converged: False if 'adaptive' sampling stopped at max_points before reaching tol
+    """
+    default_tol = {'solve': 1e-12, 'adaptive': 1e-8}
+
+    def __init__(self, f, lo, hi, vectorized=False, method='solve', tol=None, max_iter=100, n_init=33,
+                 max_points=1 << 16):
+        if not lo < hi:
+            raise ValueError('lo must be less than hi')
+        if method not in ('solve', 'adaptive'):
+            raise ValueError('Unknown inversion method {}'.format(method))
+        self._f = f if vectorized else lambda x: np.array([f(x_i) for x_i in x])
+        self.method = method
+        self.tol = self.default_tol[method] if tol is None else tol
+        self.max_iter = max_iter
+        self.n_evals = 0
+        self.converged = True
+
+        x = np.linspace(lo, hi, max(n_init, 2))
+        y = self.f(x)
+        diff_signs = np.sign(np.diff(y))
+        if not np.all(diff_signs == 1) and not np.all(diff_signs == -1):
+            raise ValueError('Non-invertible function')
+        self.increasing = diff_signs[0] == 1
+        self.x, self.y = x, y
+        if method == 'adaptive':
+            self._refine(max_points)
+        self.x_min = min(self.y[0], self.y[-1])
+        self.x_max = max(self.y[0], self.y[-1])
+
+    def f(self, x):
+        """
+        Evaluate the original function, counting evaluations
+        """
+        y = np.asarray(self._f(x), dtype=np.float64)
+        if not np.issubdtype(y.dtype, np.number):
+            raise ValueError('Input function is not numeric')
+        self.n_evals += y.size
+        return y
+
+    def _refine(self, max_points):
+        """
+        Bisect the sampled intervals in which linearly interpolating the inverse at the midpoint is off by more than
+        tol (scaled by the size of the domain), until every interval passes or max_points are sampled. Warns and sets
+        converged to False in the latter case.
+        """
+        x, y = self.x, self.y
+        scale = self.tol * (x[-1] - x[0])
+        todo = np.ones(len(x) - 1, dtype=bool)
+        while todo.any() and len(x) + todo.sum() <= max_points:
+            left = np.flatnonzero(todo)
+            x_mid = (x[left] + x[left + 1]) / 2
+            y_mid = self.f(x_mid)
+            x_lin = x[left] + (x[left + 1] - x[left]) * (y_mid - y[left]) / (y[left + 1] - y[left])
+            bad = np.abs(x_lin - x_mid) > scale
+            if np.any(np.sign(y_mid - y[left]) != np.sign(y[left + 1] - y_mid)):
+                raise ValueError('Non-invertible function')
+
+            # each bisected interval becomes two, both refined again if the midpoint was badly interpolated
+            x = np.insert(x, left + 1, x_mid)
+            y = np.insert(y, left + 1, y_mid)
+            new_todo = np.zeros(len(x) - 1, dtype=bool)
+            new_left = left + np.arange(len(left))
+            new_todo[new_left[bad]] = True
+            new_todo[new_left[bad] + 1] = True
+            todo = new_todo
+        self.x, self.y = x, y
+        if todo.any():
+            self.converged = False
+            warnings.warn('Adaptive inversion reached max_points={} with {} intervals still off by more than tol={}; '
+                          'raise max_points or tol'.format(max_points, int(todo.sum()), self.tol), RuntimeWarning,
+                          stacklevel=3)
+
+    def _interp(self, y_new):
+        if self.increasing:
+            return np.interp(y_new, self.y, self.x)
+        return np.interp(-y_new, -self.y, self.x)
+
+    def _solve(self, y_new):
+        """
+        Batched Illinois (modified regula falsi) iterations, bracketed by the sampled points
+        """
+        xs, ys = (self.x, self.y) if self.increasing else (self.x, -self.y)
+        targets = y_new if self.increasing else -y_new
+        k = np.clip(np.searchsorted(ys, targets), 1, len(xs) - 1)
+        a, b = xs[k - 1], xs[k]
+        fa, fb = ys[k - 1] - targets, ys[k] - targets
+        c = np.where(fb == 0, b, a)
+        side = np.zeros(len(targets), dtype=np.int8)
+        active = np.flatnonzero((fa != 0) & (fb != 0))
+        for _ in range(self.max_iter):
+            if len(active) == 0:
+                break
+            a_act, b_act, fa_act, fb_act = a[active], b[active], fa[active], fb[active]
+            c_act = (a_act * fb_act - b_act * fa_act) / (fb_act - fa_act)
+            stuck = ~((c_act > a_act) & (c_act < b_act))
+            c_act[stuck] = (a_act[stuck] + b_act[stuck]) / 2
+            fc = self.f(c_act)
+            fc = (fc if self.increasing else -fc) - targets[active]
+            c[active] = c_act
+
+            # fc on the same side as b replaces b, halving fa if b was replaced on the previous step too
+            same_b = np.sign(fc) == np.sign(fb_act)
+            replace_b = active[same_b]
+            b[replace_b] = c_act[same_b]
+            fb[replace_b] = fc[same_b]
+            fa[replace_b[side[replace_b] == -1]] /= 2
+            side[replace_b] = -1
+            replace_a = active[~same_b]
+            a[replace_a] = c_act[~same_b]
+            fa[replace_a] = fc[~same_b]
+            fb[replace_a[side[replace_a] == 1]] /= 2
+            side[replace_a] = 1
+
+            done = (fc == 0) | (b[active] - a[active] <= self.tol * (1 + np.abs(c_act)))
+            active = active[~done]
+        return c
+
+    def __call__(self, y_new):
+        """
+        Evaluate the inverse at y_new (scalar or array), returning NaN outside [x_min, x_max]
+        """
+        y_new = np.asarray(y_new, dtype=np.float64)
+        shape = y_new.shape
+        y_flat = y_new.ravel()
+        ans = np.full(y_flat.shape, np.nan)
+        valid = (y_flat >= self.x_min) & (y_flat <= self.x_max)
+        ans[valid] = self._interp(y_flat[valid]) if self.method == 'adaptive' else self._solve(y_flat[valid])
+        return ans.reshape(shape)[()]
+
+
+def invert_monotone(f, lo, hi, vectorized=False, method='solve', tol=None, max_iter=100, n_init=33,
+                    max_points=1 << 16):
+    """
+    Invert a strictly monotone function without a fixed grid
+    Args:
+        f: Function to invert
+        lo: Lower bound of the domain to invert the function on
+        hi: Upper bound of the domain to invert the function on
+        vectorized: Specifies if the input function is vectorized
+        method: 'solve' to solve f(x) = y for each query by batched, vectorized Illinois iterations bracketed by
+            n_init samples, or 'adaptive' to sample f more densely where linear interpolation of the inverse is
+            inaccurate and interpolate the samples
+        tol: Relative tolerance in x of the solution ('solve', default 1e-12) or of the interpolation ('adaptive',
+            default 1e-8). 'adaptive' warns if max_points samples are not enough to reach it.
+        max_iter: Maximum number of iterations per query ('solve')
+        n_init: Number of evenly spaced initial samples
+        max_points: Maximum number of samples ('adaptive')
+
+    Returns:
+        MonotoneInverse that can be called on scalars or arrays, with attributes x_min and x_max representing the
+        domain bounds on which the inverse is defined
+    """
+    return MonotoneInverse(f, lo, hi, vectorized=vectorized, method=method, tol=tol, max_iter=max_iter,
+                           n_init=n_init, max_points=max_points)
@@ -1,4 +1,7 @@
 from numpy import exp, log, log1p, ndarray, empty_like, float64, zeros_like, bool
+from numpy import (asarray, broadcast_shapes, copyto, empty, errstate, absolute, add, subtract, multiply, divide,
+                   negative, reciprocal, less, greater_equal, arange, broadcast_arrays, rint, intp, nan, isfinite,
+                   partition)
 from scipy.special import betaln
 
 _min_x_swap = 1e-16
@@ -98,4 +101,252 @@ def logbetah(a, b, n=20):
         frac = 1 - (((a_ge + k - 1) * (a_ge + b_ge + k - 1) * .5) / ((a_ge + k * 2 - 2) * (a_ge + k * 2 - 1))) / (1 + ((k * (b_ge - k) * .5) / ((a_ge + k * 2 - 1) * (a_ge + k * 2))) / frac)
     ans[~mask] = a_ge * _loghalf + b_ge * _loghalf - log(a_ge) - betaln(a_ge, b_ge) - log(frac)
 
-    return ans
\ No newline at end of file
+    return ans
+
+_fpmin = 1e-300
+_lentz_block = 16384
+class LentzWorkspace:
+    '''
+    Preallocated buffers for logbetainc_lentz so that repeated calls on arrays of the same shape allocate nothing.
+    '''
+    _float_names = ('a', 'b', 'x', 'c', 'd', 'h', 't', 'u', 'v')
+    _bool_names = ('swap', 'active', 'mask')
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        for name in self._float_names:
+            setattr(self, name, empty(self.shape, dtype=float64))
+        for name in self._bool_names:
+            setattr(self, name, empty(self.shape, dtype=bool))
+
+def _fix_tiny(arr, tmp, mask):
+    less(absolute(arr, out=tmp), _fpmin, out=mask)
+    copyto(arr, _fpmin, where=mask)
+
+def _lentz_step(aa, c, d, h, delta, active, mask):
+    '''
+    One modified Lentz step on the active elements: d = 1 / (1 + aa d), c = 1 + aa / c, h *= d c, returning d c in
+    delta.
+    '''
+    multiply(aa, d, out=d, where=active)
+    add(d, 1., out=d, where=active)
+    _fix_tiny(d, delta, mask)
+    divide(aa, c, out=c, where=active)
+    add(c, 1., out=c, where=active)
+    _fix_tiny(c, delta, mask)
+    reciprocal(d, out=d, where=active)
+    multiply(d, c, out=delta, where=active)
+    multiply(h, delta, out=h, where=active)
+
+def _lentz_cf(a, b, x, c, d, h, t, u, v, active, mask, tol, max_iter):
+    '''
+    Evaluate the continued fraction of the incomplete beta function into h, stopping early once every element has
+    converged.
+    '''
+    # c = 1, d = 1 / (1 - (a + b) x / (a + 1)), h = d
+    active.fill(True)
+    c.fill(1.)
+    add(a, b, out=d)
+    multiply(d, x, out=d)
+    add(a, 1., out=t)
+    divide(d, t, out=d)
+    subtract(1., d, out=d)
+    _fix_tiny(d, v, mask)
+    reciprocal(d, out=d)
+    copyto(h, d)
+
+    for m in range(1, max_iter + 1):
+        # even step: m (b - m) x / ((a + 2m - 1) (a + 2m))
+        subtract(b, m, out=t)
+        multiply(t, x, out=t)
+        multiply(t, m, out=t)
+        add(a, 2 * m - 1, out=u)
+        add(a, 2 * m, out=v)
+        multiply(u, v, out=u)
+        divide(t, u, out=t)
+        _lentz_step(t, c, d, h, v, active, mask)
+
+        # odd step: -(a + m) (a + b + m) x / ((a + 2m) (a + 2m + 1))
+        add(a, m, out=t)
+        add(a, b, out=u)
+        add(u, m, out=u)
+        multiply(t, u, out=t)
+        multiply(t, x, out=t)
+        negative(t, out=t)
+        add(a, 2 * m, out=u)
+        add(a, 2 * m + 1, out=v)
+        multiply(u, v, out=u)
+        divide(t, u, out=t)
+        _lentz_step(t, c, d, h, v, active, mask)
+
+        subtract(v, 1., out=v)
+        greater_equal(absolute(v, out=v), tol, out=mask)
+        active &= mask
+        if not active.any():
+            break
+
+def logbetainc_lentz(a, b, x, tol=1e-15, max_iter=1000, out=None, workspace=None):
+    '''
+    Compute the logarithm of the regularized incomplete beta function by evaluating the continued fraction with the
+    modified Lentz method, stopping each element once successive terms change it by less than tol.
+    a, b, and x are broadcast together; out and workspace (a LentzWorkspace) may be preallocated with the broadcast
+    shape so that no arrays are allocated per call.
+    '''
+    if not isinstance(max_iter, int) or max_iter <= 0:
+        raise ValueError('max_iter must be a positive integer')
+
+    shape = broadcast_shapes(asarray(a).shape, asarray(b).shape, asarray(x).shape)
+    if workspace is None:
+        workspace = LentzWorkspace(shape)
+    elif workspace.shape != shape:
+        raise ValueError('workspace shape {} does not match input shape {}'.format(workspace.shape, shape))
+    scalar = out is None and shape == ()
+    if out is None:
+        out = empty(shape, dtype=float64)
+    elif out.shape != shape or out.dtype != float64:
+        raise ValueError('out must be a float64 array of shape {}'.format(shape))
+    ws = workspace
+
+    with errstate(divide='ignore', invalid='ignore', over='ignore'):
+        copyto(ws.a, a)
+        copyto(ws.b, b)
+        copyto(ws.x, x)
+
+        # use I_x(a, b) = 1 - I_(1 - x)(b, a) where the continued fraction converges slowly
+        add(ws.a, 1., out=ws.t)
+        subtract(1., ws.x, out=ws.u)
+        multiply(ws.t, ws.u, out=ws.t)
+        add(ws.b, 1., out=ws.u)
+        multiply(ws.u, ws.x, out=ws.u)
+        less(ws.t, ws.u, out=ws.swap)
+        greater_equal(ws.x, _min_x_swap, out=ws.mask)
+        ws.swap &= ws.mask
+        copyto(ws.t, ws.a)
+        copyto(ws.a, ws.b, where=ws.swap)
+        copyto(ws.b, ws.t, where=ws.swap)
+        subtract(1., ws.x, out=ws.x, where=ws.swap)
+
+        # blocks converge independently, so a few slow elements don't keep the whole array iterating
+        flat = [arr.reshape(-1) for arr in (ws.a, ws.b, ws.x, ws.c, ws.d, ws.h, ws.t, ws.u, ws.v, ws.active, ws.mask)]
+        for i in range(0, flat[0].size, _lentz_block):
+            _lentz_cf(*(arr[i:i + _lentz_block] for arr in flat), tol, max_iter)
+
+        # log(x^a (1 - x)^b / (a B(a, b)) * h)
+        log(ws.x, out=out)
+        multiply(out, ws.a, out=out)
+        negative(ws.x, out=ws.t)
+        log1p(ws.t, out=ws.t)
+        multiply(ws.t, ws.b, out=ws.t)
+        add(out, ws.t, out=out)
+        log(ws.a, out=ws.t)
+        subtract(out, ws.t, out=out)
+        betaln(ws.a, ws.b, out=ws.t)
+        subtract(out, ws.t, out=out)
+        log(ws.h, out=ws.t)
+        add(out, ws.t, out=out)
+
+        exp(out, out=ws.t, where=ws.swap)
+        negative(ws.t, out=ws.t, where=ws.swap)
+        log1p(ws.t, out=out, where=ws.swap)
+
+    return out[()] if scalar else out
+
+def logbetah_lentz(a, b, tol=1e-15, max_iter=1000, out=None, workspace=None):
+    '''
+    Compute the logarithm of the regularized half-beta function with the adaptive Lentz evaluator (see
+    logbetainc_lentz).
+    '''
+    return logbetainc_lentz(a, b, .5, tol=tol, max_iter=max_iter, out=out, workspace=workspace)
+
+class LogBetahTable:
+    '''
+    Memoized table of logbetah over integer (a, b), grown lazily by doubling up to max_entries cells.
+    Lookups of integer a, b >= 1 inside the table are a single fancy index; anything else, including counts that would
+    grow the table past max_entries, falls back to logbetah_lentz.
+    A call grows the table towards the grow_quantile quantile of its counts, and by at most 2x per dimension (beyond
+    min_grow), so a few outliers in a batch are computed with logbetah_lentz instead of growing the table to the cap.
+    '''
+
+    def __init__(self, max_entries=1 << 24, tol=1e-15, max_iter=1000, grow_quantile=0.99, min_grow=256):
+        if not isinstance(max_entries, int) or max_entries < 4:
+            raise ValueError('max_entries must be an integer of at least 4')
+        if not 0 <= grow_quantile <= 1:
+            raise ValueError('grow_quantile must be between 0 and 1')
+        self.max_entries = max_entries
+        self.grow_quantile = grow_quantile
+        self.min_grow = min_grow
+        self.tol = tol
+        self.max_iter = max_iter
+        self.table = empty((1, 1), dtype=float64)
+        self.table.fill(nan)
+
+    @property
+    def shape(self):
+        return self.table.shape
+
+    def _fill(self, a, b):
+        return logbetah_lentz(a, b, tol=self.tol, max_iter=self.max_iter)
+
+    def reserve(self, max_a, max_b):
+        '''
+        Grow the table (by doubling) so that it covers a <= max_a and b <= max_b, as far as max_entries allows.
+        '''
+        rows, cols = self.table.shape
+        new_rows = rows
+        while new_rows <= max_a:
+            new_rows *= 2
+        new_cols = cols
+        while new_cols <= max_b:
+            new_cols *= 2
+        # give up the larger dimension first when the cap is hit, never shrinking below the current table
+        while new_rows * new_cols > self.max_entries and (new_rows > rows or new_cols > cols):
+            if new_rows > rows and (new_rows >= new_cols or new_cols == cols):
+                new_rows //= 2
+            else:
+                new_cols //= 2
+        if new_rows == rows and new_cols == cols:
+            return
+
+        table = empty((new_rows, new_cols), dtype=float64)
+        table[:rows, :cols] = self.table
+        table[0] = nan
+        table[:, 0] = nan
+        if new_cols > cols:
+            table[1:rows, cols:] = self._fill(arange(1, rows, dtype=float64)[:, None],
+                                              arange(cols, new_cols, dtype=float64)[None, :])
+        if new_rows > rows:
+            table[max(rows, 1):, 1:] = self._fill(arange(max(rows, 1), new_rows, dtype=float64)[:, None],
+                                                   arange(1, new_cols, dtype=float64)[None, :])
+        self.table = table
+
+    def _grow_target(self, counts):
+        # lower grow_quantile quantile, without interpolating towards an outlier
+        k = int(self.grow_quantile * (counts.size - 1))
+        return partition(counts.ravel(), k)[k]
+
+    def __call__(self, a, b):
+        '''
+        Compute the logarithm of the regularized half-beta function, looking up integer a, b in the table.
+        '''
+        a, b = broadcast_arrays(asarray(a), asarray(b))
+        scalar = a.ndim == 0
+        integral = (a >= 1) & (b >= 1)
+        if a.dtype.kind == 'f':
+            integral &= isfinite(a) & (a == rint(a))
+        if b.dtype.kind == 'f':
+            integral &= isfinite(b) & (b == rint(b))
+        if integral.any():
+            rows, cols = self.table.shape
+            self.reserve(min(self._grow_target(a[integral]), max(2 * rows, self.min_grow) - 1),
+                         min(self._grow_target(b[integral]), max(2 * cols, self.min_grow) - 1))
+        rows, cols = self.table.shape
+        inside = integral & (a < rows) & (b < cols)
+
+        if inside.all():
+            ans = self.table[a.astype(intp), b.astype(intp)]
+        else:
+            ans = empty(a.shape, dtype=float64)
+            ans[inside] = self.table[a[inside].astype(intp), b[inside].astype(intp)]
+            outside = ~inside
+            ans[outside] = self._fill(a[outside].astype(float64), b[outside].astype(float64))
+        return ans[()] if scalar else ans
@@ -1,7 +1,10 @@
 import numpy as np
-import re
-import xml.dom.minidom as dom
 import argparse
+import os
+import sys
+from meme_output_parser import parse_meme
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'profile_utils'))
+import stage_profiler
 
 class DNASymbol:
     path = None
@@ -31,110 +34,104 @@ class DNA_T(DNASymbol):
 
 DNASymbol.DNA_alphabet = (DNA_A, DNA_C, DNA_G, DNA_T)
 
-def pwm2logo(pwm, out_fn, symbol=DNASymbol, glyph_width=100, stack_height=200):
-    width = len(pwm)
-
-    document = dom.Document()
-    svg = document.appendChild(document.createElement('svg'))
-    svg.setAttribute('baseProfile', 'full')
-    svg.setAttribute('version', '1.1')
-    svg.setAttribute('xmlns', 'http://www.w3.org/2000/svg')
-    svg.setAttribute('viewBox', '0 0 {} {}'.format(width * glyph_width, stack_height))
-
-    defs = svg.appendChild(document.createElement('defs'))
-    for base in symbol.DNA_alphabet:
-        path = defs.appendChild(document.createElement('path'))
-        path.setAttribute('id', base.__name__)
-        path.setAttribute('d', base.path)
-        path.setAttribute('fill', base.color)
-
-    for i, pwv in enumerate(pwm):
-        n = np.sum(pwv)
-        if n == 0:
-            continue
-        vec = pwv / n
-        vec[vec > 0] *= np.log2(vec[vec > 0])
-        bits = sum(vec, symbol.max_bits)
-        heights = pwv / n * bits / symbol.max_bits * stack_height
-        idx = np.argsort(pwv)
-
-        stack = svg.appendChild(document.createElement('g'))
-        stack.setAttribute('transform', 'translate({} 0)'.format(i * glyph_width))
-
-        y_offset = 0
-        for j in idx:
-            if heights[j] == 0:
-                continue
-            base = symbol.get_symbol(j)
-            y_offset += heights[j]
-            glyph = stack.appendChild(document.createElement('path'))
-            glyph.setAttribute('d', base.path)
-            glyph.setAttribute('fill', base.color)
-            glyph.setAttribute('transform', 'matrix({} 0 0 {} 0 {})'.format(glyph_width / 100., heights[j] / 100., stack_height - y_offset))
-
-    with open(out_fn, 'w') as f:
-        svg.writexml(f, addindent='    ', newl='\n')
-
-def alinged_pwms2logo_stack(aligned_pwms, out_fn, symbol=DNASymbol, glyph_width=100, stack_height=200):
+def stack_geometry(pwms, max_bits=DNASymbol.max_bits, stack_height=200):
+    """
+    Compute the glyph heights and positions of every stack of an (..., width, 4) array of PWMs in one pass
+    Args:
+        pwms: Array of PWMs (counts or probabilities) with the alphabet on the last axis
+        max_bits: Maximum information content of a column
+        stack_height: Height of a stack with max_bits of information
+
+    Returns:
+        Mask of the non-empty columns, glyph indices of each column from bottom to top, their heights, and the y
+        coordinate of the top of each glyph
+    """
+    pwms = np.asarray(pwms, dtype=np.float64)
+    n = np.sum(pwms, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vec = pwms / n[..., None]
+        plogp = np.where(vec > 0, vec * np.log2(np.where(vec > 0, vec, 1)), vec)
+        # accumulate in the same order as sum(vec, max_bits) so heights match the per-column computation exactly
+        bits = np.full(n.shape, max_bits, dtype=np.float64)
+        for j in range(pwms.shape[-1]):
+            bits = bits + plogp[..., j]
+        heights = pwms / n[..., None] * bits[..., None] / max_bits * stack_height
+    order = np.argsort(pwms, axis=-1)
+    heights = np.take_along_axis(heights, order, axis=-1)
+    tops = stack_height - np.cumsum(heights, axis=-1)
+    return n != 0, order, heights, tops
+
+
+def write_logo_svg(aligned_pwms, out_fn, symbol=DNASymbol, glyph_width=100, stack_height=200, rows=True):
+    """
+    Stream a logo (or a stack of aligned logos) to an SVG file, drawing each glyph as a <use> of a path in <defs>
+    Args:
+        aligned_pwms: (height, width, 4) array of PWMs, one logo per row
+        out_fn: Path to the output SVG
+        symbol: Glyph alphabet
+        glyph_width: Width of a column
+        stack_height: Height of a logo
+        rows: If False, draw the first PWM as a single logo without a row group
+    """
     height, width, _ = aligned_pwms.shape
-
-    document = dom.Document()
-    svg = document.appendChild(document.createElement('svg'))
-    svg.setAttribute('baseProfile', 'full')
-    svg.setAttribute('version', '1.1')
-    svg.setAttribute('xmlns', 'http://www.w3.org/2000/svg')
-    svg.setAttribute('viewBox', '0 0 {} {}'.format(width * glyph_width, height * stack_height))
-
-    for y, pwm in enumerate(aligned_pwms):
-        row = svg.appendChild(document.createElement('g'))
-        row.setAttribute('transform', 'translate(0 {})'.format(y * stack_height))
-        for i, pwv in enumerate(pwm):
-            n = np.sum(pwv)
-            if n == 0:
-                continue
-            vec = pwv / n
-            vec[vec > 0] *= np.log2(vec[vec > 0])
-            bits = sum(vec, symbol.max_bits)
-            heights = pwv / n * bits / symbol.max_bits * stack_height
-            idx = np.argsort(pwv)
-    
-            stack = row.appendChild(document.createElement('g'))
-            stack.setAttribute('transform', 'translate({} 0)'.format(i * glyph_width))
-    
-            y_offset = 0
-            for j in idx:
-                if heights[j] == 0:
-                    continue
-                base = symbol.get_symbol(j)
-                y_offset += heights[j]
-                glyph = stack.appendChild(document.createElement('path'))
-                glyph.setAttribute('d', base.path)
-                glyph.setAttribute('fill', base.color)
-                glyph.setAttribute('transform', 'matrix({} 0 0 {} 0 {})'.format(glyph_width / 100., heights[j] / 100., stack_height - y_offset))
+    nonempty, order, heights, tops = stack_geometry(aligned_pwms, symbol.max_bits, stack_height)
+    hrefs = ['#{}'.format(symbol.get_symbol(j).__name__) for j in range(aligned_pwms.shape[-1])]
+    scale_x = glyph_width / 100.
+    indent = '        ' if rows else '    '
 
     with open(out_fn, 'w') as f:
-        svg.writexml(f, addindent='    ', newl='\n')
+        f.write('<?xml version="1.0" ?>\n')
+        f.write('<svg baseProfile="full" version="1.1" viewBox="0 0 {} {}" xmlns="http://www.w3.org/2000/svg" '
+                'xmlns:xlink="http://www.w3.org/1999/xlink">\n'.format(width * glyph_width, height * stack_height))
+        f.write('    <defs>\n')
+        for base in symbol.DNA_alphabet:
+            f.write('        <path d="{}" fill="{}" id="{}"/>\n'.format(base.path, base.color, base.__name__))
+        f.write('    </defs>\n')
+
+        for y in range(height):
+            if rows:
+                f.write('    <g transform="translate(0 {})">\n'.format(y * stack_height))
+            row_order, row_heights, row_tops = order[y].tolist(), heights[y].tolist(), tops[y].tolist()
+            for i in np.flatnonzero(nonempty[y]).tolist():
+                lines = ['{}<g transform="translate({} 0)">\n'.format(indent, i * glyph_width)]
+                for j, h, top in zip(row_order[i], row_heights[i], row_tops[i]):
+                    if h == 0:
+                        continue
+                    lines.append('{}    <use transform="matrix({} 0 0 {} 0 {})" xlink:href="{}"/>\n'.format(
+                        indent, scale_x, h / 100., top, hrefs[j]))
+                lines.append('{}</g>\n'.format(indent))
+                f.write(''.join(lines))
+            if rows:
+                f.write('    </g>\n')
+        f.write('</svg>\n')
 
-if __name__ == '__main__':
-    name_pattern = re.compile('MOTIF\s+(.+)')
+def pwm2logo(pwm, out_fn, symbol=DNASymbol, glyph_width=100, stack_height=200):
+    write_logo_svg(np.asarray(pwm)[None], out_fn, symbol=symbol, glyph_width=glyph_width, stack_height=stack_height,
+                   rows=False)
+
+def alinged_pwms2logo_stack(aligned_pwms, out_fn, symbol=DNASymbol, glyph_width=100, stack_height=200):
+    write_logo_svg(np.asarray(aligned_pwms), out_fn, symbol=symbol, glyph_width=glyph_width, stack_height=stack_height)
 
-    parser = argparse.ArgumentParser()
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument('meme_fn', help='MEME file')
     parser.add_argument('out_dir', help='output directory')
     parser.add_argument('--revcomp', '-rc', action='store_true', help='output reverse complement')
-    args = parser.parse_args()
-
-    with open(args.meme_fn) as f:
-        for line in f:
-            if line.startswith('MOTIF'):
-                motif = name_pattern.match(line).group(1).strip()
-                for line in f:
-                    if line.startswith('letter-probability matrix'):
-                        break
-                pwm = []
-                for line in f:
-                    if not line.strip():
-                        break
-                    pwm.append(list(map(float, line.split())))
-                pwm = np.flip(np.array(pwm)) if args.revcomp else np.array(pwm)
-                pwm2logo(pwm, '{}/{}.svg'.format(args.out_dir, motif))
+    stage_profiler.add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    with stage_profiler.profiler_from_args('generate_motif_logos', args):
+        with stage_profiler.stage('parse_meme', bytes_read=os.path.getsize(args.meme_fn)) as stage:
+            motifs = parse_meme(args.meme_fn, sites=False)
+            stage.add(rows=len(motifs))
+        for motif in motifs:
+            if motif['pwm'] is None:
+                continue
+            pwm = np.flip(motif['pwm']) if args.revcomp else motif['pwm']
+            out_fn = '{}/{}.svg'.format(args.out_dir, motif['name'])
+            with stage_profiler.stage('write_svg', rows=len(pwm)) as stage:
+                pwm2logo(pwm, out_fn)
+                stage.add(bytes_written=os.path.getsize(out_fn))
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,140 @@
-import pandas as pd
+import numpy as np
 import re
+import io
+import argparse
+from multiprocessing import Pool
+
+_kv_pattern = re.compile(r'([\w\-]+)\s*=\s*(\S+)')
+
+
+def _parse_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def _split_name(name):
+    # name:start-end or name:start-end(.) -> (name, start), anything else -> (name, 0)
+    chrom, sep, region = name.rpartition(':')
+    start = region.partition('-')[0]
+    if sep and start.isdigit():
+        return chrom, int(start)
+    return name, 0
+
+
+def _new_motif(line):
+    header = line[len('MOTIF'):].strip()
+    kv_start = _kv_pattern.search(header)
+    ids = (header[:kv_start.start()] if kv_start else header).split()
+    meta = {key: _parse_number(value) for key, value in _kv_pattern.findall(header)}
+    return {'name': header, 'id': ids[0] if ids else '', 'alt': ids[1] if len(ids) > 1 else None, 'meta': meta,
+            'width': meta.get('width'), 'pwm': None, 'sites': None}
+
+
+def _sites_frame(lines, widths):
+    """
+    Parse the lines of all the sites tables in a file at once into columns
+    Args:
+        lines: Site lines
+        widths: Motif width of each line (0 if unknown)
+    """
+    import pandas as pd
+    if not lines:
+        return pd.DataFrame({'chromosome': [], 'start': np.array([], dtype=np.int64),
+                             'stop': np.array([], dtype=np.int64), 'strand': [],
+                             'p-value': np.array([], dtype=np.float64), 'seq': []})
+    # name, strand, start, p-value, left flank, site, right flank (flanks may be missing at sequence ends)
+    table = pd.read_csv(io.StringIO(''.join(lines)), sep=r'\s+', header=None, names=range(7), dtype=str)
+    idx = table[2].to_numpy(dtype=np.int64)
+    # the site is the column after the left flank unless that flank is missing
+    seq = table[5].where((table[5].str.len() == widths) | ((widths == 0) & table[5].notna()), table[4])
+    widths = np.where(widths > 0, widths, seq.str.len().to_numpy(dtype=np.int64))
+
+    chrom, offset = zip(*map(_split_name, table[0].tolist()))
+    offset = np.array(offset, dtype=np.int64)
+    return pd.DataFrame({'chromosome': list(chrom),
+                         'start': offset + idx - 1,
+                         'stop': offset + idx + widths - 1,
+                         'strand': table[1].tolist(),
+                         'p-value': table[3].to_numpy(dtype=np.float64),
+                         'seq': seq.tolist()})
+
+
+def parse_meme(meme_fn, sites=True):
+    """
+    Parse a MEME output file (full text output or minimal motif format) in one pass
+    Args:
+        meme_fn: Path to MEME output file
+        sites: If False, skip the sites tables (and the pandas import), leaving sites as None
+
+    Returns:
+        List of dicts, one for each motif, with keys
+            name: Everything after MOTIF on the motif's header line
+            id, alt: Motif identifier and alternate name
+            meta: Header fields (e.g. width, sites, llr, E-value) and letter-probability matrix fields (alength, w,
+                nsites, E)
+            width: Motif width
+            pwm: (width, alength) letter-probability matrix, or None if the file has none for the motif
+            sites: DataFrame of sites sorted by position p-value (chromosome, start, stop, strand, p-value, seq).
+                Sequence names of the form name:start-end(.) are converted to genomic coordinates.
+    """
+    motifs = []
+    site_lines = []
+    site_motifs = []
+    state = 'scan'
+    skip = 0
+    with open(meme_fn, 'r') as f:
+        for line in f:
+            if skip:
+                skip -= 1
+                continue
+
+            if state == 'sites':
+                if line.startswith('-'):
+                    state = 'scan'
+                elif sites and line.strip():
+                    site_lines.append(line)
+                    site_motifs.append(len(motifs) - 1)
+
+            elif state == 'matrix':
+                if not line.strip() or line.startswith('-'):
+                    motifs[-1]['pwm'] = np.array(pwm)
+                    state = 'scan'
+                    continue
+                pwm.append([float(p) for p in line.split()])
+
+            elif line.startswith('MOTIF'):
+                motifs.append(_new_motif(line))
+
+            elif motifs and 'sites sorted by position p-value' in line:
+                # dashes, column names, dashes
+                state = 'sites'
+                skip = 3
+
+            elif motifs and line.startswith('letter-probability matrix'):
+                meta = {key: _parse_number(value) for key, value in _kv_pattern.findall(line)}
+                motifs[-1]['meta'].update(meta)
+                if motifs[-1]['width'] is None:
+                    motifs[-1]['width'] = meta.get('w')
+                state = 'matrix'
+                pwm = []
+
+    if state == 'matrix':
+        motifs[-1]['pwm'] = np.array(pwm)
+    if not sites:
+        return motifs
+    site_motifs = np.array(site_motifs, dtype=np.int64)
+    widths = np.array([motif['width'] or 0 for motif in motifs], dtype=np.int64)
+    sites = _sites_frame(site_lines, widths[site_motifs])
+    bounds = np.searchsorted(site_motifs, np.arange(len(motifs) + 1))
+    for i, motif in enumerate(motifs):
+        motif['sites'] = sites.iloc[bounds[i]:bounds[i + 1]].reset_index(drop=True)
+    return motifs
+
 
 def parse_meme_output(meme_fn):
     """
@@ -10,38 +145,65 @@ def parse_meme_output(meme_fn):
     Returns:
         List of DataFrames, one for each motif
     """
+    return [motif['sites'] for motif in parse_meme(meme_fn)]
 
-    wpattern = re.compile('MOTIF \w+ MEME-\d+\s+width =\s+(\d+)')
-    hpattern = re.compile('Motif \w+ MEME-\d+ sites sorted by position p-value')
-    datapattern = re.compile('(chr[\dM]+):(\d+)-(\d+)\(\.\)\s+([\+\-])\s+(\d+)\s+([\d\.\-e]+)\s+[\.\w]+\s+(\w+)')
-    meme_dicts = []
-    with open(meme_fn, 'r') as f:
-        n = 0
-        for line in f:
-            match = re.search(wpattern, line)
-            if match:
-                n += 1
-                meme_dicts.append({'chromosome': [], 'start': [], 'stop': [], 'strand': [], 'p-value': [], 'seq': []})
-                width = int(match.group(1))
-            if re.search(hpattern, line):
-                f.readline()
-                f.readline()
-                f.readline()
-                line = f.readline()
-                while not line.startswith('-'):
-                    chrom, start, stop, strand, idx, pval, seq = re.search(datapattern, line).groups()
-                    start = int(start)
-                    stop = int(start)
-                    idx = int(idx)
-                    pval = float(pval)
-                    stop = start + idx + width - 1
-                    start = start + idx - 1
-                    meme_dicts[-1]['chromosome'].append(chrom)
-                    meme_dicts[-1]['start'].append(start)
-                    meme_dicts[-1]['stop'].append(stop)
-                    meme_dicts[-1]['strand'].append(strand)
-                    meme_dicts[-1]['p-value'].append(pval)
-                    meme_dicts[-1]['seq'].append(seq)
-                    line = f.readline()
-
-    return [pd.DataFrame(meme_dict) for meme_dict in meme_dicts]
+
+def parse_meme_files(meme_fns, processes=1):
+    """
+    Parse many MEME output files, in a process pool if processes > 1
+    Args:
+        meme_fns: Paths to MEME output files
+        processes: Number of processes
+
+    Returns:
+        List of parse_meme results in the same order as meme_fns
+    """
+    if processes <= 1:
+        return [parse_meme(meme_fn) for meme_fn in meme_fns]
+    with Pool(processes) as pool:
+        return pool.map(parse_meme, meme_fns, chunksize=max(1, len(meme_fns) // (processes * 4)))
+
+
+def summarize_meme_files(meme_fns, processes=1, results=None):
+    """
+    One row per motif across many MEME output files
+    Args:
+        meme_fns: Paths to MEME output files
+        processes: Number of processes
+        results: parse_meme_files results for meme_fns, if already parsed
+
+    Returns:
+        DataFrame with the file, motif id, alternate name, width, number of sites, E-value, and number of parsed sites
+    """
+    import pandas as pd
+    rows = []
+    if results is None:
+        results = parse_meme_files(meme_fns, processes)
+    for meme_fn, motifs in zip(meme_fns, results):
+        for motif in motifs:
+            meta = motif['meta']
+            rows.append((meme_fn, motif['id'], motif['alt'], motif['width'], meta.get('sites', meta.get('nsites')),
+                         float(meta.get('E-value', meta.get('E', np.nan))), len(motif['sites'])))
+    return pd.DataFrame(rows, columns=['file', 'motif', 'alt', 'width', 'sites', 'E-value', 'n_parsed_sites'])
+
+
+def main(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('meme_fns', nargs='+', help='MEME output files')
+    parser.add_argument('--out', '-o', default='meme_summary.tsv', help='output motif summary table')
+    parser.add_argument('--sites', '-s', default=None, help='also write all sites to this table')
+    parser.add_argument('--processes', '-p', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    results = parse_meme_files(args.meme_fns, args.processes)
+    summarize_meme_files(args.meme_fns, results=results).to_csv(args.out, sep='\t', index=False)
+
+    if args.sites is not None:
+        import pandas as pd
+        frames = [motif['sites'].assign(file=meme_fn, motif=motif['id'])
+                  for meme_fn, motifs in zip(args.meme_fns, results) for motif in motifs]
+        pd.concat(frames, ignore_index=True).to_csv(args.sites, sep='\t', index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import json
+import time
+import threading
+import argparse
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def fake_sample(sample_id: int):
+    """
+    A fetchSampleData record with deterministic fake metadata for a sample ID
+    """
+    targets = ['Reb1', 'Abf1', 'H3K4me3', 'Rap1', 'Nrd1']
+    return {'id': sample_id, 'target': targets[sample_id % len(targets)], 'antibody': 'i5006', 'strain': 'BY4741',
+            'geneticModification': '-', 'growthMedia': 'YPD', 'treatments': ['-', 'HS'][sample_id % 2],
+            'assay': 'XO', 'experiments': [{'alignments': [{'dedupUniquelyMappedReads': 1000 * sample_id}]}]}
+
+class MockPegrServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the PEGR fetchSampleData API
+
+    samples: dict
+        Sample records by ID (defaults to fake_sample for any positive ID)
+    api_key: str
+        Required apiKey query parameter
+    delay: float
+        Seconds to wait before answering each request
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), samples: dict = None, api_key: str = 'test', delay: float = 0):
+        super().__init__(address, _Handler)
+        self.samples = samples
+        self.api_key = api_key
+        self.delay = delay
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://{}:{}/pegr/api/fetchSampleData'.format(*self.server_address)
+
+    def lookup(self, sample_id):
+        if self.samples is None:
+            return fake_sample(sample_id) if sample_id > 0 else None
+        return self.samples.get(sample_id)
+
+    def start(self):
+        """
+        Serve in a daemon thread, returns self
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        with self.server._count_lock:
+            self.server.requests += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        url = urllib.parse.urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not url.path.endswith('/fetchSampleData'):
+            return self._reply(404, {'message': 'Not found'})
+        if urllib.parse.parse_qs(url.query).get('apiKey') != [self.server.api_key]:
+            return self._reply(401, {'message': 'Invalid API key'})
+        try:
+            sample_id = int(json.loads(body)['id'])
+        except (ValueError, KeyError, TypeError):
+            return self._reply(400, {'message': 'Invalid request'})
+        sample = self.server.lookup(sample_id)
+        if sample is None:
+            return self._reply(200, {'message': 'Sample {} not found'.format(sample_id)})
+        self._reply(200, {'message': 'Success!', 'data': [sample]})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', '-p', type=int, default=8765)
+    parser.add_argument('--api_key', default='test')
+    parser.add_argument('--samples', default=None, help='JSON file with a list of sample records (defaults to fake ones)')
+    parser.add_argument('--delay', type=float, default=0, help='seconds to wait before answering each request')
+    args = parser.parse_args()
+
+    samples = None
+    if args.samples is not None:
+        with open(args.samples) as f:
+            samples = {int(sample['id']): sample for sample in json.load(f)}
+    server = MockPegrServer(('127.0.0.1', args.port), samples=samples, api_key=args.api_key, delay=args.delay)
+    print(server.url)
+    server.serve_forever()
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import asyncio
+import argparse
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+
+default_url = 'https://thanos.vmhost.psu.edu/pegr/api/fetchSampleData'
+default_email = 'jsc6015@psu.edu'
+default_token = os.path.join(os.path.expanduser('~'), '.tokens', 'pegr_token.txt')
+default_cache = os.path.join(os.path.expanduser('~'), '.cache', 'pegr', 'samples.sqlite')
+
+class PegrError(RuntimeError):
+    pass
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return '+'.join(_text(v) for v in value)
+    if isinstance(value, dict):
+        return _text(value.get('name', json.dumps(value, sort_keys=True)))
+    return str(value)
+
+@dataclass
+class SampleRecord:
+    """
+    Metadata of one PEGR sample (the fields printed by sample_query.sh)
+    """
+    id: int
+    target: str
+    antibody: str
+    strain: str
+    genetic_modification: str
+    growth_media: str
+    treatments: str
+    assay: str
+    dedup_reads: int
+    raw: dict = field(default=None, repr=False, compare=False)
+
+    @property
+    def condition(self):
+        """
+        Condition used in the target-condition pileup groups (the treatments, '-' if there are none)
+        """
+        return self.treatments or '-'
+
+    @classmethod
+    def from_json(cls, data: dict):
+        try:
+            dedup_reads = data['experiments'][0]['alignments'][0]['dedupUniquelyMappedReads']
+        except (KeyError, IndexError, TypeError):
+            dedup_reads = None
+        return cls(id=int(data['id']), target=_text(data.get('target')), antibody=_text(data.get('antibody')),
+                   strain=_text(data.get('strain')), genetic_modification=_text(data.get('geneticModification')),
+                   growth_media=_text(data.get('growthMedia')), treatments=_text(data.get('treatments')),
+                   assay=_text(data.get('assay')), dedup_reads=None if dedup_reads is None else int(dedup_reads),
+                   raw=data)
+
+_columns = [f.name for f in fields(SampleRecord) if f.name != 'raw'] + ['condition']
+
+def to_dataframe(records: list):
+    """
+    records: list
+        SampleRecords
+
+    Returns a DataFrame with one row per record (pandas is only imported when this is called)
+    """
+    import pandas as pd
+    return pd.DataFrame([[getattr(record, column) for column in _columns] for record in records], columns=_columns)
+
+def write_sample_table(records: list, out: str):
+    """
+    Write records as a tab-separated table with an id, target, and condition column (see bulk_pileup --sample_table)
+    """
+    with open(out, 'w') as f:
+        f.write('\t'.join(_columns) + '\n')
+        for record in records:
+            f.write('\t'.join(_text(getattr(record, column)) for column in _columns) + '\n')
+
+class ResponseCache:
+    """
+    Persistent cache of fetchSampleData responses in an sqlite database, keyed by sample ID
+
+    path: str
+        Path to the sqlite database
+    ttl: float
+        Seconds a cached response stays valid (None to never expire)
+    """
+
+    def __init__(self, path: str = default_cache, ttl: float = 7 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS responses (id TEXT PRIMARY KEY, fetched REAL, body TEXT)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get_many(self, ids: list):
+        """
+        Returns a dict mapping the IDs with fresh cached responses to the parsed responses
+        """
+        ids = [str(i) for i in ids]
+        oldest = 0 if self.ttl is None else time.time() - self.ttl
+        found = {}
+        with self._connect() as db:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = db.execute('SELECT id, body FROM responses WHERE fetched >= ? AND id IN ({})'.format(
+                    ','.join('?' * len(chunk))), [oldest, *chunk])
+                found.update((i, json.loads(body)) for i, body in rows)
+        return found
+
+    def put_many(self, responses: dict):
+        now = time.time()
+        with self._connect() as db:
+            db.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                           [(str(i), now, json.dumps(body)) for i, body in responses.items()])
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute('DELETE FROM responses')
+
+class ConnectionPool:
+    """
+    Pool of persistent HTTP(S) connections to one host, safe to share between threads
+
+    url: str
+        URL of the endpoint (only the scheme, host, and port are used)
+    size: int
+        Maximum number of open connections
+    timeout: float
+        Socket timeout in seconds
+    """
+
+    def __init__(self, url: str, size: int = 8, timeout: float = 60):
+        parsed = urllib.parse.urlsplit(url)
+        self._cls = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = queue.Queue()
+        for _ in range(size):
+            self._slots.put(None)
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None):
+        """
+        Returns the status and body of the response, retrying once on a fresh connection if a reused one was closed.
+        A connection that fails (including by timing out) is closed rather than returned to the pool.
+        """
+        self._slots.get()
+        try:
+            try:
+                conn, reused = self._idle.get_nowait(), True
+            except queue.Empty:
+                conn, reused = self._cls(self._host, self._port, timeout=self._timeout), False
+            while True:
+                try:
+                    conn.request(method, path, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.HTTPException, OSError) as e:
+                    conn.close()
+                    # only a stale reused connection is worth retrying, a timeout would just wait again
+                    if not reused or isinstance(e, TimeoutError):
+                        raise
+                    conn, reused = self._cls(self._host, self._port, timeout=self._timeout), False
+            if response.will_close:
+                conn.close()
+            else:
+                self._idle.put(conn)
+            return response.status, data
+        finally:
+            self._slots.put(None)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class PegrClient:
+    """
+    Client for the PEGR fetchSampleData API with pooled connections, bounded concurrency, and a response cache
+
+    url: str
+        URL of the fetchSampleData endpoint
+    api_key: str
+        PEGR API key (defaults to the contents of ~/.tokens/pegr_token.txt)
+    user_email: str
+        Email of the PEGR user
+    cache: ResponseCache
+        Response cache (None to always query PEGR)
+    concurrency: int
+        Maximum number of requests in flight
+    """
+
+    def __init__(self, url: str = default_url, api_key: str = None, user_email: str = default_email,
+                 cache: ResponseCache = None, concurrency: int = 8, timeout: float = 60):
+        if api_key is None:
+            with open(default_token) as f:
+                api_key = f.read().strip()
+        parsed = urllib.parse.urlsplit(url)
+        self.path = '{}?{}'.format(parsed.path, urllib.parse.urlencode({'apiKey': api_key}))
+        self.user_email = user_email
+        self.cache = cache
+        self.concurrency = concurrency
+        self.pool = ConnectionPool(url, size=concurrency, timeout=timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+
+    def fetch_json(self, sample_id: int):
+        """
+        Returns the parsed fetchSampleData response for one sample, raising PegrError unless it succeeded (including
+        for network errors and timeouts)
+        """
+        body = json.dumps({'id': int(sample_id), 'userEmail': self.user_email}).encode()
+        try:
+            status, data = self.pool.request('POST', self.path, body=body,
+                                             headers={'Content-Type': 'application/json'})
+        except (http.client.HTTPException, OSError) as e:
+            raise PegrError('Sample {}: {}'.format(sample_id, e)) from e
+        try:
+            response = json.loads(data)
+        except ValueError:
+            raise PegrError('Sample {}: HTTP {} with a non-JSON response'.format(sample_id, status))
+        if response.get('message') != 'Success!':
+            raise PegrError('Sample {}: {}'.format(sample_id, response.get('message')))
+        return response
+
+    async def _fetch_all(self, ids: list, errors: str):
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            async def fetch(sample_id):
+                async with semaphore:
+                    try:
+                        return sample_id, await loop.run_in_executor(executor, self.fetch_json, sample_id)
+                    except PegrError:
+                        if errors == 'raise':
+                            raise
+                        return sample_id, None
+            return dict(await asyncio.gather(*(fetch(sample_id) for sample_id in ids)))
+
+    async def fetch_responses_async(self, ids: list, errors: str = 'raise'):
+        """
+        ids: list
+            Sample IDs
+        errors: str
+            'raise' to raise PegrError for a failed lookup, 'skip' to leave it out
+
+        Returns a dict mapping the sample IDs (as str) to their responses, from the cache where it is fresh
+        """
+        ids = list(dict.fromkeys(str(int(i)) for i in ids))
+        responses = self.cache.get_many(ids) if self.cache is not None else {}
+        missing = [i for i in ids if i not in responses]
+        if missing:
+            fetched = {i: r for i, r in (await self._fetch_all(missing, errors)).items() if r is not None}
+            if self.cache is not None and fetched:
+                self.cache.put_many(fetched)
+            responses.update(fetched)
+        return {i: responses[i] for i in ids if i in responses}
+
+    def fetch_responses(self, ids: list, errors: str = 'raise'):
+        """
+        Blocking version of fetch_responses_async, which also works when called from a running event loop (e.g. in
+        Jupyter)
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.fetch_responses_async(ids, errors=errors))
+        # asyncio.run cannot be called from a running loop, so give the lookup its own loop in a helper thread
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(asyncio.run, self.fetch_responses_async(ids, errors=errors)).result()
+
+    def fetch(self, ids: list, errors: str = 'raise'):
+        """
+        Returns SampleRecords for the sample IDs, in the same order (see fetch_responses)
+        """
+        return [SampleRecord.from_json(response['data'][0])
+                for response in self.fetch_responses(ids, errors=errors).values()]
+
+    def fetch_dataframe(self, ids: list, errors: str = 'raise'):
+        return to_dataframe(self.fetch(ids, errors=errors))
+
+def main(argv: list = None, prog: str = None):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument('ids', nargs='+', help='sample IDs, or a file containing a list of sample IDs')
+    parser.add_argument('--out', '-o', default=None, help='write a sample table here instead of printing records')
+    parser.add_argument('--url', default=default_url, help='fetchSampleData endpoint')
+    parser.add_argument('--api_key', default=None, help='PEGR API key (defaults to ~/.tokens/pegr_token.txt)')
+    parser.add_argument('--email', default=default_email, help='PEGR user email')
+    parser.add_argument('--concurrency', '-j', type=int, default=8, help='maximum number of requests in flight')
+    parser.add_argument('--cache', default=default_cache, help='sqlite response cache')
+    parser.add_argument('--ttl', type=float, default=7 * 24 * 3600, help='seconds a cached response stays valid')
+    parser.add_argument('--no_cache', action='store_true', help='always query PEGR')
+    parser.add_argument('--skip_errors', action='store_true', help='leave out samples that fail instead of exiting')
+    args = parser.parse_args(argv)
+
+    ids = args.ids
+    if len(ids) == 1 and os.path.isfile(ids[0]):
+        with open(ids[0]) as f:
+            ids = f.read().split()
+    cache = None if args.no_cache else ResponseCache(args.cache, ttl=args.ttl)
+    with PegrClient(args.url, api_key=args.api_key, user_email=args.email, cache=cache,
+                    concurrency=args.concurrency) as client:
+        records = client.fetch(ids, errors='skip' if args.skip_errors else 'raise')
+    if args.out is not None:
+        write_sample_table(records, args.out)
+    else:
+        for record in records:
+            print('\t'.join(_text(getattr(record, column)) for column in _columns))
+
+if __name__ == '__main__':
+    main()
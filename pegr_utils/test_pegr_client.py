@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import asyncio
+import pytest
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from mock_pegr_server import MockPegrServer
+from pegr_client import PegrClient, PegrError, ResponseCache
+
+@pytest.fixture
+def server():
+    server = MockPegrServer(delay=0.2).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _client(server, tmp_path=None, **kwargs):
+    cache = ResponseCache(str(tmp_path / 'samples.sqlite')) if tmp_path is not None else None
+    return PegrClient(server.url, api_key='test', cache=cache, **kwargs)
+
+def test_concurrency_and_cache(server, tmp_path):
+    with _client(server, tmp_path, concurrency=4) as client:
+        start = time.perf_counter()
+        responses = client.fetch_responses(range(1, 9))
+        elapsed = time.perf_counter() - start
+        assert list(responses) == [str(i) for i in range(1, 9)]
+        assert server.requests == 8
+        # 8 requests of 0.2 s, 4 at a time
+        assert 0.4 <= elapsed < 1.2
+
+        records = client.fetch([3, 1, 3])
+        assert [record.id for record in records] == [3, 1]
+        assert server.requests == 8
+
+def test_errors(server, tmp_path):
+    with _client(server, tmp_path) as client:
+        assert list(client.fetch_responses([1, -1, 2], errors='skip')) == ['1', '2']
+        assert server.requests == 3
+        with pytest.raises(PegrError, match='not found'):
+            client.fetch_responses([-1])
+        assert server.requests == 4
+        # failed lookups are not cached
+        client.fetch_responses([1, 2, -1], errors='skip')
+        assert server.requests == 5
+
+def test_timeout(server, tmp_path):
+    server.delay = 1
+    with _client(server, tmp_path, concurrency=2, timeout=0.2) as client:
+        start = time.perf_counter()
+        assert client.fetch_responses([1, 2], errors='skip') == {}
+        assert time.perf_counter() - start < 0.9
+        assert server.requests == 2
+        with pytest.raises(PegrError, match='timed out'):
+            client.fetch_responses([1])
+        assert server.requests == 3
+
+    server.delay = 0
+    with _client(server, tmp_path) as client:
+        assert list(client.fetch_responses([1, 2])) == ['1', '2']
+        assert server.requests == 5
+
+def test_running_event_loop(server):
+    async def lookup(client):
+        # the blocking API from inside a running loop, as in Jupyter
+        blocking = client.fetch_responses([1, 2])
+        awaited = await client.fetch_responses_async([3])
+        return blocking, awaited
+
+    with _client(server) as client:
+        blocking, awaited = asyncio.run(lookup(client))
+    assert list(blocking) == ['1', '2'] and list(awaited) == ['3']
+    assert server.requests == 3
@@ -0,0 +1,328 @@
+import os
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+env_var = 'JCSCRIPTS_PROFILE'
+cprofile_env_var = 'JCSCRIPTS_CPROFILE'
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+_rss_scale = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss(children=False):
+    """
+    Peak resident set size in bytes of this process (or of its largest finished child process)
+    """
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss * _rss_scale
+
+
+def _proc_rss():
+    # current and peak resident set size in bytes since the last reset_peak_rss (Linux only)
+    try:
+        with open('/proc/self/status') as f:
+            status = dict(line.split(':', 1) for line in f.read().splitlines() if ':' in line)
+        return int(status['VmRSS'].split()[0]) * 1024, int(status['VmHWM'].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS of this process (VmHWM, and with it ru_maxrss) to the current RSS through /proc/self/clear_refs.
+    Returns False where that is not possible (not Linux, or /proc/self/clear_refs is not writable).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _proc_io():
+    # characters read and written through syscalls, including cached I/O (Linux only)
+    try:
+        with open('/proc/self/io') as f:
+            io = dict(line.split(': ') for line in f.read().splitlines())
+        return int(io['rchar']), int(io['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class Stage:
+    """
+    Counters of one running stage, returned by StageProfiler.stage
+    """
+    __slots__ = ('rows', 'bytes_read', 'bytes_written')
+
+    def __init__(self, rows=0, bytes_read=0, bytes_written=0):
+        self.rows = rows
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+
+    def add(self, rows=0, bytes_read=0, bytes_written=0):
+        self.rows += rows
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+
+class StageProfiler:
+    """
+    Records the wall and CPU time, rows, bytes read and written, lock waits, and peak RSS of named stages of a run and
+    writes them as a JSON report. Stages with the same name are summed; stages can be nested.
+    The peak RSS of a stage is measured by resetting the process peak when the stage starts (see reset_peak_rss) and
+    reading it when it ends; the peak_rss_per_stage field of the report is True if that worked. Otherwise a stage's
+    peak_rss is the process peak if it was reached during the stage, and the larger of the RSS at its start and end
+    if not (a lower bound).
+    Args:
+        name: Name of the run (usually the script name)
+        out: Path of the JSON report, written when the profiler is closed (None to only keep it in memory)
+        cprofile: True to also run every stage under cProfile, or a collection of stage names to profile. Profiles
+            are written next to the report as <out>.<stage>.prof.
+    """
+
+    def __init__(self, name, out=None, cprofile=False):
+        self.name = name
+        self.out = out
+        self.cprofile = cprofile
+        self.stages = {}
+        self.lock_wait = 0.0
+        self._active = []
+        self._start = time.perf_counter()
+        self._start_cpu = time.process_time()
+        self._started = time.time()
+        self._profiles = {}
+        self._profiling = False
+        self._peak_rss = 0
+        self._rss_reset = None
+
+    def _should_cprofile(self, name):
+        if self.cprofile is True:
+            return True
+        return bool(self.cprofile) and name in self.cprofile
+
+    @contextmanager
+    def stage(self, name, rows=0, bytes_read=0, bytes_written=0):
+        """
+        Time the body of the with block as stage name. The yielded Stage takes counts seen during the stage, e.g.
+        stage.add(rows=len(chunk)).
+        """
+        counters = Stage(rows, bytes_read, bytes_written)
+        record = self.stages.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'lock_wait': 0.0, 'rows': 0,
+                                               'bytes_read': 0, 'bytes_written': 0, 'io_read': 0, 'io_written': 0,
+                                               'peak_rss': 0})
+        profile = None
+        # only one cProfile can run at a time, so a nested stage is profiled as part of its outer stage
+        if self._should_cprofile(name) and not self._profiling:
+            if name not in self._profiles:
+                import cProfile
+                self._profiles[name] = cProfile.Profile()
+            profile = self._profiles[name]
+            self._profiling = True
+        start_peak = self._enter_rss()
+        self._active.append(record)
+        io = _proc_io()
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield counters
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            record['wall'] += time.perf_counter() - start
+            record['cpu'] += time.process_time() - start_cpu
+            self._active.pop()
+            if io is not None:
+                end_io = _proc_io()
+                record['io_read'] += end_io[0] - io[0]
+                record['io_written'] += end_io[1] - io[1]
+            record['calls'] += 1
+            record['rows'] += counters.rows
+            record['bytes_read'] += counters.bytes_read
+            record['bytes_written'] += counters.bytes_written
+            record['peak_rss'] = max(record['peak_rss'], self._exit_rss(start_peak))
+
+    def _enter_rss(self):
+        # fold the peak since the last reset into the running stages and the run before resetting it for the new stage
+        if self._rss_reset is not False:
+            self._note_peak(peak_rss())
+        if self._rss_reset is None:
+            self._rss_reset = reset_peak_rss() and _proc_rss() is not None
+        elif self._rss_reset:
+            reset_peak_rss()
+        if self._rss_reset:
+            return None
+        rss = _proc_rss()
+        return peak_rss(), rss[0] if rss is not None else 0
+
+    def _exit_rss(self, start_peak):
+        if start_peak is None:
+            peak = _proc_rss()[1]
+        else:
+            # without a reset, the process peak belongs to this stage only if it grew during it
+            start_max, start_rss = start_peak
+            end_max = peak_rss()
+            rss = _proc_rss()
+            peak = end_max if end_max > start_max else max(start_rss, rss[0] if rss is not None else 0)
+        self._note_peak(peak)
+        return peak
+
+    def _note_peak(self, peak):
+        self._peak_rss = max(self._peak_rss, peak)
+        for record in self._active:
+            record['peak_rss'] = max(record['peak_rss'], peak)
+
+    @contextmanager
+    def lock(self, lock):
+        """
+        Acquire lock (e.g. a SoftFileLock) for the with block, adding the time spent waiting for it to the running
+        stages
+        """
+        start = time.perf_counter()
+        with lock:
+            wait = time.perf_counter() - start
+            self.lock_wait += wait
+            for record in self._active:
+                record['lock_wait'] += wait
+            yield lock
+
+    def report(self):
+        """
+        Returns the report as a dict
+        """
+        return {'name': self.name, 'argv': sys.argv, 'pid': os.getpid(), 'started': self._started,
+                'wall': time.perf_counter() - self._start, 'cpu': time.process_time() - self._start_cpu,
+                'lock_wait': self.lock_wait, 'peak_rss': max(self._peak_rss, peak_rss()),
+                'children_peak_rss': peak_rss(children=True), 'peak_rss_per_stage': bool(self._rss_reset),
+                'stages': self.stages}
+
+    def close(self):
+        """
+        Write the report (and cProfile stats) if out is set
+        """
+        if self.out is None:
+            return
+        out_dir = os.path.dirname(os.path.abspath(self.out))
+        os.makedirs(out_dir, exist_ok=True)
+        for name, profile in self._profiles.items():
+            profile.dump_stats('{}.{}.prof'.format(self.out, name))
+        with open(self.out, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def __enter__(self):
+        return activate(self)
+
+    def __exit__(self, *exc):
+        activate(None)
+        self.close()
+
+
+class NullProfiler:
+    """
+    Stand-in used when profiling is off: every method does nothing
+    """
+    name = None
+    out = None
+    _stage = Stage()
+
+    def stage(self, name, rows=0, bytes_read=0, bytes_written=0):
+        return _null_stage_cm
+
+    def lock(self, lock):
+        return lock
+
+    def report(self):
+        return {}
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class _NullStageContext:
+    __slots__ = ()
+
+    def __enter__(self):
+        return NullProfiler._stage
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_stage_cm = _NullStageContext()
+null_profiler = NullProfiler()
+_current = null_profiler
+
+
+def activate(profiler):
+    """
+    Make profiler the one used by stage and lock (None for the null profiler), returns it
+    """
+    global _current
+    _current = null_profiler if profiler is None else profiler
+    return _current
+
+
+def current():
+    return _current
+
+
+def stage(name, rows=0, bytes_read=0, bytes_written=0):
+    """
+    StageProfiler.stage of the active profiler (a no-op unless profiling is on)
+    """
+    return _current.stage(name, rows, bytes_read, bytes_written)
+
+
+def lock(lock):
+    """
+    StageProfiler.lock of the active profiler (just the lock unless profiling is on)
+    """
+    return _current.lock(lock)
+
+
+def get_profiler(name, out=None, cprofile=None):
+    """
+    Profiler for a run, the null profiler unless a report path is given or set in $JCSCRIPTS_PROFILE. If the
+    environment variable names a directory, the report is written there as <name>.<pid>.json.
+    Args:
+        name: Name of the run
+        out: Path of the JSON report
+        cprofile: Stage names to run under cProfile ('all' for every stage), defaults to $JCSCRIPTS_CPROFILE
+    """
+    out = out or os.environ.get(env_var)
+    if not out:
+        return null_profiler
+    if os.path.isdir(out) or out.endswith(os.sep):
+        out = os.path.join(out, '{}.{}.json'.format(name, os.getpid()))
+    if cprofile is None:
+        cprofile = os.environ.get(cprofile_env_var)
+    if isinstance(cprofile, str):
+        cprofile = True if cprofile in ('all', '1') else set(cprofile.split(','))
+    return StageProfiler(name, out, cprofile=cprofile or False)
+
+
+def add_profile_arguments(parser):
+    """
+    Add the --profile and --cprofile options to an argparse parser
+    """
+    parser.add_argument('--profile', default=None, metavar='REPORT',
+                        help='write a JSON report of per-stage time, I/O, rows, lock waits, and peak RSS here '
+                             '(or set ${})'.format(env_var))
+    parser.add_argument('--cprofile', default=None, metavar='STAGES',
+                        help='comma-separated stages to run under cProfile, or "all" (written as <REPORT>.<stage>.prof)')
+
+
+def profiler_from_args(name, args):
+    return get_profiler(name, args.profile, args.cprofile)
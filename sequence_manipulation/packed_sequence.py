@@ -0,0 +1,188 @@
+import numpy as np
+import argparse
+import os
+from nucleotide_map import nucleotide_map
+
+_header = np.dtype('<u8')
+_any = 15  # bitmask of A | C | G | T, written as N
+
+# byte value -> 4-bit IUPAC bitmask (A=1, C=2, G=4, T=8), unknown characters are N
+encode_lut = np.full(256, _any, dtype=np.uint8)
+for code, letter in enumerate(nucleotide_map):
+    if code != 0:
+        encode_lut[ord(letter)] = code
+        encode_lut[ord(letter.lower())] = code
+decode_lut = np.frombuffer(''.join(nucleotide_map).encode(), dtype=np.uint8)
+
+# complementing swaps A <-> T and C <-> G, which reverses the 4 bits of a code. Reversing all 8 bits of a packed byte
+# also swaps its two bases, so one table reverse-complements a byte in place.
+_bits = np.arange(8)
+revcomp_lut = np.array([sum(((b >> i) & 1) << (7 - i) for i in _bits) for b in range(256)], dtype=np.uint8)
+_acgt_bits = np.arange(4, dtype=np.uint8)
+
+
+def pack_codes(codes):
+    """
+    Pack an array of 4-bit codes two per byte (the first base in the high nibble)
+    """
+    codes = np.asarray(codes, dtype=np.uint8)
+    if len(codes) % 2:
+        codes = np.append(codes, np.uint8(0))
+    return (codes[0::2] << 4) | codes[1::2]
+
+
+def unpack_codes(data, start, end):
+    """
+    4-bit codes of bases start to end of packed data
+    """
+    idx = np.arange(start, end)
+    byte = data[idx >> 1]
+    return np.where(idx & 1, byte & 15, byte >> 4).astype(np.uint8)
+
+
+def codes_to_onehot(codes, ambiguous='zero', dtype=np.uint8):
+    """
+    One-hot encode 4-bit codes (any shape) into a trailing A, C, G, T axis
+    Args:
+        codes: Array of 4-bit codes
+        ambiguous: How to encode ambiguous bases: 'zero' for all zeros (like onehot.onehot), 'bits' for a 1 in every
+            possible base, or 'fraction' to split the probability evenly between the possible bases
+        dtype: Output dtype (float64 for 'fraction')
+
+    Returns:
+        Array of shape (*codes.shape, 4)
+    """
+    bits = (codes[..., None] >> _acgt_bits) & 1
+    if ambiguous == 'bits':
+        return bits.astype(dtype)
+    if ambiguous == 'zero':
+        bits[(codes != 1) & (codes != 2) & (codes != 4) & (codes != 8)] = 0
+        return bits.astype(dtype)
+    if ambiguous == 'fraction':
+        counts = bits.sum(axis=-1, keepdims=True)
+        return np.divide(bits, counts, out=np.zeros(bits.shape), where=counts > 0)
+    raise ValueError('Unknown ambiguous base encoding: {}'.format(ambiguous))
+
+
+class PackedSequence:
+    """
+    Nucleotide sequence stored as 4-bit IUPAC bitmasks (see nucleotide_map), two bases per byte
+    Args:
+        data: uint8 array of packed bytes (may be a memmap)
+        length: Number of bases
+    """
+
+    def __init__(self, data, length):
+        if len(data) * 2 < length:
+            raise ValueError('{} bytes cannot hold {} bases'.format(len(data), length))
+        self.data = data
+        self.length = length
+
+    @classmethod
+    def from_string(cls, seq):
+        """
+        Pack a str or bytes sequence
+        """
+        if isinstance(seq, str):
+            seq = seq.encode()
+        return cls(pack_codes(encode_lut[np.frombuffer(seq, dtype=np.uint8)]), len(seq))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a packed sequence file (an 8-byte little-endian base count followed by the packed bytes)
+        Args:
+            path: Path to the file
+            mmap: If True, memory-map the packed bytes read-only instead of reading them
+        """
+        with open(path, 'rb') as f:
+            length = int(np.frombuffer(f.read(_header.itemsize), dtype=_header)[0])
+            if not mmap:
+                return cls(np.fromfile(f, dtype=np.uint8, count=(length + 1) // 2), length)
+        if length == 0:
+            return cls(np.empty(0, dtype=np.uint8), 0)
+        return cls(np.memmap(path, dtype=np.uint8, mode='r', offset=_header.itemsize, shape=((length + 1) // 2,)),
+                   length)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(np.array([self.length], dtype=_header).tobytes())
+            np.asarray(self.data[:(self.length + 1) // 2]).tofile(f)
+
+    def __len__(self):
+        return self.length
+
+    def _bounds(self, start, end):
+        start = 0 if start is None else start
+        end = self.length if end is None else end
+        if not 0 <= start <= end <= self.length:
+            raise IndexError('Window {}-{} out of bounds for sequence of length {}'.format(start, end, self.length))
+        return start, end
+
+    def codes(self, start=None, end=None):
+        """
+        4-bit codes of bases start to end
+        """
+        return unpack_codes(self.data, *self._bounds(start, end))
+
+    def decode(self, start=None, end=None):
+        """
+        Sequence of bases start to end as a str
+        """
+        return decode_lut[self.codes(start, end)].tobytes().decode()
+
+    def window(self, start=None, end=None):
+        """
+        Bases start to end as a PackedSequence, sharing memory with this one if start is even
+        """
+        start, end = self._bounds(start, end)
+        if start % 2 == 0:
+            return PackedSequence(self.data[start // 2:(end + 1) // 2], end - start)
+        return PackedSequence(pack_codes(self.codes(start, end)), end - start)
+
+    def windows(self, starts, width):
+        """
+        4-bit codes of equal-width windows as an (n, width) array
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        if len(starts) and (starts.min() < 0 or starts.max() + width > self.length):
+            raise IndexError('Windows of width {} out of bounds for sequence of length {}'.format(width, self.length))
+        idx = starts[:, None] + np.arange(width)
+        byte = self.data[idx >> 1]
+        return np.where(idx & 1, byte & 15, byte >> 4).astype(np.uint8)
+
+    def onehot(self, start=None, end=None, ambiguous='zero', dtype=np.uint8):
+        """
+        One-hot encoding of bases start to end as an (end - start, 4) array (see codes_to_onehot)
+        """
+        return codes_to_onehot(self.codes(start, end), ambiguous=ambiguous, dtype=dtype)
+
+    def revcomp(self):
+        """
+        Reverse complement, computed on the packed bytes
+        """
+        n_bytes = (self.length + 1) // 2
+        data = revcomp_lut[self.data[:n_bytes][::-1]]
+        if self.length % 2:
+            # the padding nibble of the last byte is now the first base, shift everything up by one base
+            data = (data << 4) | np.append(data[1:] >> 4, np.uint8(0))
+        return PackedSequence(data, self.length)
+
+
+def pack_fasta(fasta_fn, out_dir):
+    """
+    Pack every record of a FASTA file into <out_dir>/<name>.pk4 (name is the first word of the header)
+    """
+    from seq_batch import iter_fasta
+    os.makedirs(out_dir, exist_ok=True)
+    for name, seq in iter_fasta(fasta_fn):
+        PackedSequence.from_string(seq).save(os.path.join(out_dir, '{}.pk4'.format(name.split()[0].decode())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('fasta_fn', help='FASTA file (optionally gzipped)')
+    parser.add_argument('out_dir', help='directory to write one <name>.pk4 packed sequence per record to')
+    args = parser.parse_args()
+
+    pack_fasta(args.fasta_fn, args.out_dir)
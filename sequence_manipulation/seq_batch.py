@@ -0,0 +1,168 @@
+import numpy as np
+import argparse
+import gzip
+from compl import compl_
+
+_compl_bytes = bytes.maketrans(''.join(compl_).encode(), ''.join(compl_.values()).encode())
+_compl_str = str.maketrans(''.join(compl_), ''.join(compl_.values()))
+
+# rows are byte values, columns are A, C, G, T; anything else (N, gaps, padding) is all zeros
+onehot_lut = np.zeros((256, 4), dtype=np.uint8)
+for i, base in enumerate('ACGT'):
+    onehot_lut[ord(base), i] = 1
+    onehot_lut[ord(base.lower()), i] = 1
+onehot_lut_rc = onehot_lut[:, ::-1].copy()
+
+
+def revcomp(seq, reverse=True):
+    """
+    Complement (and by default reverse) a str or bytes sequence with a translation table
+    """
+    if isinstance(seq, str):
+        seq = seq.translate(_compl_str)
+    else:
+        seq = bytes(seq).translate(_compl_bytes)
+    return seq[::-1] if reverse else seq
+
+
+def encode_batch(seqs, length=None, rc=False, out=None):
+    """
+    One-hot encode a batch of sequences into one zero-padded array
+    Args:
+        seqs: List of str or bytes sequences
+        length: Padded length (defaults to the longest sequence, longer sequences are truncated)
+        rc: If True, encode the reverse complement of each sequence (left-aligned like the forward sequences)
+        out: Preallocated uint8 array of shape (at least len(seqs), length, 4) to write into
+
+    Returns:
+        (n, length, 4) uint8 array with channels A, C, G, T
+    """
+    seqs = [seq.encode() if isinstance(seq, str) else seq for seq in seqs]
+    n = len(seqs)
+    lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=n)
+    if length is None:
+        length = int(lengths.max()) if n else 0
+    if out is None:
+        out = np.empty((n, length, 4), dtype=np.uint8)
+    elif out.shape[0] < n or out.shape[1:] != (length, 4):
+        raise ValueError('out must have shape (>= {}, {}, 4), not {}'.format(n, length, out.shape))
+    out = out[:n]
+
+    codes = np.zeros((n, length), dtype=np.uint8)
+    flat = np.frombuffer(b''.join(seqs), dtype=np.uint8)
+    rows = np.repeat(np.arange(n), lengths)
+    starts = np.cumsum(lengths) - lengths
+    cols = np.arange(len(flat)) - np.repeat(starts, lengths)
+    if rc:
+        cols = np.repeat(lengths - 1, lengths) - cols
+    keep = cols < length
+    codes[rows[keep], cols[keep]] = flat[keep]
+    np.take(onehot_lut_rc if rc else onehot_lut, codes, axis=0, out=out)
+    return out
+
+
+def _open(fn):
+    return gzip.open(fn, 'rb') if fn.endswith('.gz') else open(fn, 'rb')
+
+
+def iter_fasta(fn):
+    """
+    Stream (name, sequence) records as bytes from a FASTA file (optionally gzipped)
+    """
+    with _open(fn) as f:
+        name, chunks = None, []
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            if line.startswith(b'>'):
+                if name is not None:
+                    yield name, b''.join(chunks)
+                name, chunks = line[1:], []
+            elif line:
+                chunks.append(line)
+        if name is not None:
+            yield name, b''.join(chunks)
+
+
+def iter_fastq(fn):
+    """
+    Stream (name, sequence, quality) records as bytes from a FASTQ file (optionally gzipped)
+    """
+    with _open(fn) as f:
+        while True:
+            header = f.readline()
+            if not header:
+                return
+            seq = f.readline().rstrip(b'\r\n')
+            f.readline()
+            qual = f.readline().rstrip(b'\r\n')
+            yield header.rstrip(b'\r\n')[1:], seq, qual
+
+
+def iter_sequences(fn):
+    """
+    Stream (name, sequence) records as bytes from a FASTA or FASTQ file, detected from the first character
+    """
+    with _open(fn) as f:
+        first = f.read(1)
+    if first == b'@':
+        for name, seq, _ in iter_fastq(fn):
+            yield name, seq
+    else:
+        yield from iter_fasta(fn)
+
+
+def iter_onehot_batches(fn, length, batch_size=4096, rc=False, out=None):
+    """
+    One-hot encode a FASTA or FASTQ file in batches
+    Args:
+        fn: Path to the FASTA or FASTQ file
+        length: Padded length of every sequence
+        batch_size: Number of sequences per batch
+        rc: If True, encode reverse complements
+        out: Preallocated (batch_size, length, 4) uint8 buffer, reused for every batch
+
+    Returns:
+        Generator of (names, (n, length, 4) array) per batch; the array is a view of out, overwritten by the next
+        batch
+    """
+    if out is None:
+        out = np.empty((batch_size, length, 4), dtype=np.uint8)
+    names, seqs = [], []
+    for name, seq in iter_sequences(fn):
+        names.append(name.decode())
+        seqs.append(seq)
+        if len(seqs) == batch_size:
+            yield names, encode_batch(seqs, length, rc=rc, out=out)
+            names, seqs = [], []
+    if seqs:
+        yield names, encode_batch(seqs, length, rc=rc, out=out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('in_fn', help='FASTA or FASTQ file (optionally gzipped)')
+    parser.add_argument('out_fn', help='output .npy file (onehot) or FASTA file (revcomp)')
+    parser.add_argument('--format', '-f', default='onehot', choices=['onehot', 'revcomp'])
+    parser.add_argument('--length', '-l', type=int, default=None,
+                        help='padded length for onehot (defaults to the longest sequence)')
+    parser.add_argument('--rc', action='store_true', help='one-hot encode reverse complements')
+    parser.add_argument('--batch_size', '-b', type=int, default=4096)
+    args = parser.parse_args()
+
+    if args.format == 'revcomp':
+        with open(args.out_fn, 'wb') as f:
+            for name, seq in iter_sequences(args.in_fn):
+                f.write(b'>' + name + b'\n' + revcomp(seq) + b'\n')
+    else:
+        n, length = 0, 0
+        for _, seq in iter_sequences(args.in_fn):
+            n += 1
+            length = max(length, len(seq))
+        length = args.length or length
+        out = np.lib.format.open_memmap(args.out_fn, mode='w+', dtype=np.uint8, shape=(n, length, 4))
+        row = 0
+        buffer = np.empty((args.batch_size, length, 4), dtype=np.uint8)
+        for names, batch in iter_onehot_batches(args.in_fn, length, args.batch_size, rc=args.rc, out=buffer):
+            out[row:row + len(names)] = batch
+            row += len(names)
+        out.flush()